@@ -1,57 +1,56 @@
-from dash import Dash, dcc, html, Input, Output
-from dash.exceptions import PreventUpdate
-import dash
-import dash_bootstrap_components as dbc
-import plotly.graph_objects as go
-import plotly.express as px
-import plotly.io as pio
-import pandas as pd
-import geopandas as gpd
-from ast import literal_eval
-import re
-import s3fs
-import requests
-import netCDF4
-import xarray as xr
-from shapely import wkt
-from shapely.geometry import Point, Polygon
-from rgb import *
-
 import time
 
 app_start = time.time()
 
+from startup import timed, report_imports, warm_up, WARMUP
+
+with timed('dash'):
+	from dash import Dash, dcc, html, Input, Output, State
+	from dash.exceptions import PreventUpdate
+	import dash
+	import dash_bootstrap_components as dbc
+with timed('plotly'):
+	import plotly.graph_objects as go
+	import plotly.io as pio
+with timed('app modules'):
+	from prefetch import Prefetcher
+	from coalesce import Generations
+	from surface import surface_grid, SURFACE_CORE
+	from catalog import load_catalog
+	from viewport import REPORT_VIEWPORT
+	from basemap import map_figure
+	from metrics import registry, trace, span
+
+import uuid
+
 page_start = time.time()
 
 csv_load_start = time.time()
-storm_dataset = pd.read_csv('data/storm_data_opt.csv', dtype={'lon': np.float64,
-														'lat': np.float64,
-														'n1': np.float64,
-														'e1': np.float64,
-														's1': np.float64,
-														'w1': np.float64,
-														'n2': np.float64,
-														'e2': np.float64,
-														's2': np.float64,
-														'w2': np.float64})
+# Compiled from data/storm_data.csv on first run (see catalog.py)
+storm_catalog = load_catalog()
 csv_load_end = time.time()
-print(f'Page load: import dataset csv: \n\t{csv_load_end - csv_load_start}')
+print(f'Page load: load storm catalog: \n\t{csv_load_end - csv_load_start}')
 
-# storm_dataset['m1_window'] = storm_dataset['m1_window'].apply(wkt.loads)
-# storm_dataset['m2_window'] = storm_dataset['m2_window'].apply(wkt.loads)
-
-# storm_gpd = gpd.GeoDataFrame(storm_dataset)
-storm_list = storm_dataset['storm_name'].unique()
-fs = s3fs.S3FileSystem(anon=True)
+storm_list = storm_catalog.storm_list
 
 app = Dash(__name__, external_stylesheets=[dbc.themes.SLATE])
 
+# Stage latency histograms and bytes read, for Prometheus to scrape
+@app.server.route('/metrics')
+def metrics():
+	return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+prefetcher = Prefetcher()
+generations = Generations()
+
 pio.templates.default = "plotly_dark"
 
-s3fs_connect_start = time.time()
-fs.open("s3://noaa-goes16/ABI-L2-MCMIPM/2021/241/14/OR_ABI-L2-MCMIPM1-M6_G16_s20212411400278_e20212411400347_c20212411400421.nc")
-s3fs_connect_end = time.time()
-print(f'Page load: s3fs open connection: \n\t{s3fs_connect_end - s3fs_connect_start}')
+report_imports()
+
+# Granule access, compositing and the S3 connection are set up off the
+# startup path (see startup.py)
+if WARMUP:
+	warm_up()
 
 def make_empty_fig():
     figure = go.Figure()
@@ -70,7 +69,7 @@ def make_empty_fig():
 
 ###################################################### Layout
 
-app.layout = html.Div([
+page_layout = html.Div([
 	html.Br(),
 	html.H3('Hurricane Satellite Imagery Browser', style={'textAlign': 'center', 'color': 'white'}),
 # 	html.H4('Atlantic Hurricanes: 2021', style={'textAlign': 'center', 'color': 'white'}),
@@ -170,6 +169,8 @@ app.layout = html.Div([
 								'text-transform': 'uppercase'}),
 				html.Br(),
 				dcc.Store(id='rgb-store'), 
+				dcc.Store(id='map-storm'),
+				dcc.Store(id='rgb-factor'),
 				html.Div(id='output'),
 				dbc.Spinner(dcc.Graph(style={'height': '67vh'},id='image-graph', 
 							figure=make_empty_fig(), responsive=True,
@@ -205,6 +206,26 @@ app.layout = html.Div([
 # 				html.Br(),
 				]),
 				html.Br(),
+				dbc.Row([
+					dbc.Label('Mesoscale Sectors',
+							style={'text-align': 'left',
+									'color': 'white',
+									'text-transform': 'uppercase'}),
+					html.Br(),
+					dcc.Checklist(
+						id='side-by-side',
+						options=[' M1 and M2 Side by Side'],
+						value=[],
+						labelStyle={'display': 'block'}
+					),
+					dcc.Checklist(
+						id='crop-toggle',
+						options=[' Zoom to Storm Centre'],
+						value=[],
+						labelStyle={'display': 'block'}
+					),
+				]),
+				html.Br(),
 				dbc.Row([
 				html.Br(),
 					dbc.Label('Download Options',
@@ -244,8 +265,21 @@ app.layout = html.Div([
 
 ], style={'backgroundColor': 'black'})
 
+def serve_layout():
+	# Each page load gets its own session id so superseded callbacks can be
+	# told apart from the latest one
+	return html.Div([dcc.Store(id='session-id', data=str(uuid.uuid4())),
+					 dcc.Store(id='viewport'),
+					 page_layout])
+
+app.layout = serve_layout
+
+# The browser reports the image panel's size in device pixels (viewport.py)
+app.clientside_callback(REPORT_VIEWPORT, Output('viewport', 'data'), Input('session-id', 'data'))
+
 page_end = time.time()
-print(f'Total page load and layout: \n\t{page_end - page_start}\n')
+print(f'Total page load and layout: \n\t{page_end - page_start}')
+print(f'Total startup: \n\t{page_end - app_start}\n')
 
 ###################################################### Callbacks
 
@@ -255,436 +289,88 @@ print(f'Total page load and layout: \n\t{page_end - page_start}\n')
 	Output('image-graph', 'className'),
 	Output('rgb-store', 'data'),
 	Output('output','children'),
+	Output('map-storm', 'data'),
 	Input('storm-dropdown', 'value'),
 	Input('time-slider', 'value'),
+	Input('crop-toggle', 'value'),
+	State('rgb-selector', 'value'),
+	State('side-by-side', 'value'),
+	State('session-id', 'data'),
+	State('map-storm', 'data'),
 )
 	
-def update_graphs(storm_name, selected_time):
-	plotting_start = time.time()
+@trace('update_graphs')
+def update_graphs(storm_name, selected_time, crop, rgb_selection, side_by_side, session_id, map_storm):
+	from granules import resolve_granules, fetch_granules, open_granule, load_granule
+	from render import no_image_note, mode_variables, uses_lut
+	from rgb import channel_variables
+	from geoloc import crop_window, CROP_PIXELS
+
 	if not storm_name:
 		raise PreventUpdate
+
+	# Only the latest slider position per session runs to completion; older
+	# runs stop at the next stage boundary
+	token = generations.begin(session_id)
 		
-	data_setup_start = time.time()
-	df = storm_dataset[storm_dataset['storm_name'].eq(storm_name)].reset_index(drop=True)
-	data_setup_end = time.time()
-	print(f'Graphing: data setup: \n\t{data_setup_end - data_setup_start}')
-				
-	map_calc_start = time.time()
-	location = Point((df['lon'][selected_time:selected_time+1]),
-					 (df['lat'][selected_time:selected_time+1]))
-					 
-	n1 = df['n1'][selected_time]
-	e1 = df['e1'][selected_time]
-	s1 = df['s1'][selected_time]
-	w1 = df['w1'][selected_time]
-	n2 = df['n2'][selected_time]
-	e2 = df['e2'][selected_time]
-	s2 = df['s2'][selected_time]
-	w2 = df['w2'][selected_time]
-					 
-	m1_window = Polygon([(e1, n1),
-						 (e1, s1),
-						 (w1, s1),
-						 (w1, n1),
-						 (e1, n1)])
-						 
-	m2_window = Polygon([(e2, n2),
-						 (e2, s2),
-						 (w2, s2),
-						 (w2, n2),
-						 (e2, n2)])
-	
-# 	m1_window = df['m1_window'][selected_time]					 
-# 	m2_window = df['m2_window'][selected_time]
-	
-	map_fig_start = time.time()
-	map_fig = go.Figure()
-	map_fig.add_trace(go.Scattergeo(
-				name='Window 1',
-				lon = (e1, e1, w1, w1, e1),
-				lat = (n1, s1, s1, n1, n1),
-				mode = 'lines',
-				line = dict(
-					color = 'purple'),
-				fill = 'toself'))
-				
-	map_fig.add_trace(go.Scattergeo(
-				name='Window 2',
-				lon = (e2, e2, w2, w2, e2),
-				lat = (n2, s2, s2, n2, n2),
-				mode = 'lines',
-				line = dict(
-					color = 'orange'),
-				fill = 'toself'))
-
-	map_fig.add_trace(go.Scattergeo(
-				name='Storm Path',
-				lon = df['lon'],
-				lat = df['lat'],
-				mode = 'lines', 
-				line = dict(
-					width = 1, 
-					color = 'white'),
-				opacity = 0.8))
-
-	map_fig.add_trace(go.Scattergeo(
-				name=storm_name,
-				lon = df['lon'][selected_time:selected_time+1],
-				lat = df['lat'][selected_time:selected_time+1],
-				mode = 'markers', 
-				marker = dict(
-					size = 8, 
-					color = 'white', 
-					symbol = '200'),
-				opacity = 0.8))
-	map_fig_end = time.time()
-	print(f'Graphing: map figure creation: \n\t{map_fig_end - map_fig_start}')
-
-	if location.within(m1_window):	
-	
-		map_calc_end = time.time()
-		print(f'Graphing: map calculations: \n\t{map_calc_end - map_calc_start}')
-		
-		s3fs_m1_start = time.time()
-		m1 = fs.open(fs.glob(f'{df.m1_combined[selected_time]}*.nc')[0])
-		s3fs_m1_end = time.time()
-		print(f'Graphing: s3fs mesoscale 1 load: \n\t{s3fs_m1_end - s3fs_m1_start}')
-
-		xarray_read_start = time.time()
-		m1_data = xr.load_dataset(m1)
-		xarray_read_end = time.time()
-		print(f'Graphing: xarray read time: \n\t{xarray_read_end - xarray_read_start}')
+	df = storm_catalog.storm(storm_name)
 				
-		surface_start = time.time()
-		surface_fig = go.Figure(go.Surface(x=m1_data.x,y=m1_data.y,z=m1_data.CMI_C13,
+	with span('map figure'):
+		# Per-storm base map, cached; a time step only moves the windows,
+		# the storm marker and the globe's rotation (basemap.py)
+		map_fig = map_figure(storm_catalog, storm_name, selected_time, shown=map_storm)
+
+		# Window membership of the storm centre is precomputed in the catalog
+		window = df['window'][selected_time]
+		if window == 1:
+			sector, note = 'm1_combined', None
+		elif window == 2:
+			sector, note = 'm2_combined', None
+		else:
+			sector, note = 'm1_combined', no_image_note(storm_name)
+
+	with span('open granule'):
+		# Everything this view shows is fetched at once: the storm's sector,
+		# and the other one too when both are displayed
+		other = 'm2_combined' if sector == 'm1_combined' else 'm1_combined'
+		prefixes = [df[sector][selected_time]]
+		if side_by_side:
+			prefixes.append(df[other][selected_time])
+		keys = resolve_granules(prefixes)
+		# Crop view: only the pixels around the storm centre are read, as
+		# ranged reads of the HDF5 chunks under the window, so the whole
+		# object is not fetched (unless both sectors are shown in full)
+		cropped = crop and note is None
+		if not cropped or side_by_side:
+			fetch_granules(keys)
+		granule = keys[0]
+		G = open_granule(granule)
+
+		window = None
+		if cropped:
+			window = crop_window(G, df['lat'][selected_time], df['lon'][selected_time], CROP_PIXELS)
+	generations.check(token)
+
+	with span('read'):
+		data = load_granule(granule, channel_variables((13,)), window=window)
+	generations.check(token)
+
+	with span('surface'):
+		# Block-reduced to the panel's vertex budget; full resolution is ~1M vertices
+		surface_x, surface_y, surface_z = surface_grid(data.x, data.y, data.CMI_C13, core=SURFACE_CORE)
+		surface_fig = go.Figure(go.Surface(x=surface_x,y=surface_y,z=surface_z,
 								 showlegend=False, showscale=False,
 								 colorscale='ice_r')
 		)
-		surface_end = time.time()
-		print(f'Graphing: surface plot: \n\t{surface_end - surface_start}')
-		
-		color_plot_start = time.time()
-		rgb = {
-			' Natural Color': px.imshow(
-				m1_data.rgb.NaturalColor(gamma=0.9, night_IR=True))
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' Enhanced IR': px.imshow(
-				m1_data.CMI_C13, color_continuous_scale=ColorizedIR(), aspect='equal')
-				.update_coloraxes(showscale=False)
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange=True),
-			' (Day) Cloud Convection': px.imshow(
-				m1_data.rgb.DayCloudConvection())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' (Day) Convection': px.imshow(
-				m1_data.rgb.DayConvection())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' (Day) Cloud Phase': px.imshow(
-				m1_data.rgb.DayCloudPhase())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' Air Mass': px.imshow(
-				m1_data.rgb.AirMass())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' Water Vapor': px.imshow(
-				m1_data.rgb.WaterVapor())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' Differential Water Vapor': px.imshow(
-				m1_data.rgb.DifferentialWaterVapor())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-		}
-		
-		color_plot_end = time.time()
-		print(f'Graphing: color plots to memory: \n\t{color_plot_end - color_plot_start}')
-		
-	elif location.within(m2_window):
-	
-		s3fs_m2_start = time.time()
-		m2 = fs.open(fs.glob(f'{df.m2_combined[selected_time]}*.nc')[0])
-		s3fs_m2_end = time.time()
-		print(f'Graphing: s3fs mesoscale 2 load: \n\t{s3fs_m2_end - s3fs_m2_start}')
-
-		xarray_read_start = time.time()
-		m2_data = xr.load_dataset(m2)
-		xarray_read_end = time.time()
-		print(f'Graphing: xarray read time: \n\t{xarray_read_end - xarray_read_start}')
-		
-		surface_start = time.time()	
-		surface_fig = go.Figure(go.Surface(x=m2_data.x,y=m2_data.y,z=m2_data.CMI_C13,
-								 showlegend=False, showscale=False,
-								 colorscale='ice_r')
-		)
-		surface_end = time.time()
-		print(f'Graphing: surface plot: \n\t{surface_end - surface_start}')
-		
-		color_plot_start = time.time()
-		rgb = {
-			' Natural Color': px.imshow(
-				m2_data.rgb.NaturalColor(gamma=0.9, night_IR=True))
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' Enhanced IR': px.imshow(
-				m2_data.CMI_C13, color_continuous_scale=ColorizedIR(), aspect='equal')
-				.update_coloraxes(showscale=False)
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange=True),
-			' (Day) Cloud Convection': px.imshow(
-				m2_data.rgb.DayCloudConvection())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' (Day) Convection': px.imshow(
-				m2_data.rgb.DayConvection())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' (Day) Cloud Phase': px.imshow(
-				m2_data.rgb.DayCloudPhase())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' Air Mass': px.imshow(
-				m2_data.rgb.AirMass())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' Water Vapor': px.imshow(
-				m2_data.rgb.WaterVapor())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-			' Differential Water Vapor': px.imshow(
-				m2_data.rgb.DifferentialWaterVapor())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed'),
-		}
-		
-		color_plot_end = time.time()
-		print(f'Graphing: color plots to memory: \n\t{color_plot_end - color_plot_start}')
+	generations.check(token)
 
-	else:
-	
-		s3fs_m1_start = time.time()
-		m1 = fs.open(fs.glob(f'{df.m1_combined[selected_time]}*.nc')[0])
-		s3fs_m1_end = time.time()
-		print(f'Graphing: s3fs mesoscale 1 load: \n\t{s3fs_m1_end - s3fs_m1_start}')
-
-		xarray_read_start = time.time()
-		m1_data = xr.load_dataset(m1)
-		xarray_read_end = time.time()
-		print(f'Graphing: xarray read time: \n\t{xarray_read_end - xarray_read_start}')
-		
-		surface_fig = go.Figure(go.Surface(x=m1_data.x,y=m1_data.y,z=m1_data.CMI_C13,
-								 showlegend=False, showscale=False,
-								 colorscale='ice_r')
-		)
+	# Color plots are rendered lazily by update_rgb, one mode at a time
+	# shape: full-resolution pixels of the image, for picking its block size
+	shape = ([window['y'][1] - window['y'][0], window['x'][1] - window['x'][0]] if window else
+			 [G.sizes['y'], G.sizes['x']])
+	rgb = {'granule': granule, 'note': note, 'window': window, 'shape': shape,
+		   'sectors': [df['m1_combined'][selected_time], df['m2_combined'][selected_time]]}
 
-		rgb = {
-			' Natural Color': px.imshow(
-				m1_data.rgb.NaturalColor(gamma=0.9, night_IR=True))
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed')
-				.add_annotation(
-					x=0.5,
-					y=0.5,
-					text=f'No Mesoscale Image<br>of {storm_name}<br>at This Time',
-					xref='paper',
-					yref='paper',
-					showarrow=False,
-					font_size=30,
-					font_color='cyan', 
-					bordercolor="gray",
-					bgcolor="gray",
-					opacity=0.8),
-					
-			' Enhanced IR': px.imshow(
-				m1_data.CMI_C13,
-				color_continuous_scale=ColorizedIR(),
-				aspect='equal')
-				.update_coloraxes(showscale=False)
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange=True)
-				.add_annotation(
-					x=0.5,
-					y=0.5,
-					text=f'No Mesoscale Image<br>of {storm_name}<br>at This Time',
-					xref='paper',
-					yref='paper',
-					showarrow=False,
-					font_size=30,
-					font_color='cyan', 
-					bordercolor="gray",
-					bgcolor="gray",
-					opacity=0.8),
-					
-			' (Day) Cloud Convection': px.imshow(
-				m1_data.rgb.DayCloudConvection())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed')
-				.add_annotation(
-					x=0.5,
-					y=0.5,
-					text=f'No Mesoscale Image<br>of {storm_name}<br>at This Time',
-					xref='paper',
-					yref='paper',
-					showarrow=False,
-					font_size=30,
-					font_color='cyan', 
-					bordercolor="gray",
-					bgcolor="gray",
-					opacity=0.8),
-
-			' (Day) Convection': px.imshow(
-				m1_data.rgb.DayConvection())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed')
-				.add_annotation(
-					x=0.5,
-					y=0.5,
-					text=f'No Mesoscale Image<br>of {storm_name}<br>at This Time',
-					xref='paper',
-					yref='paper',
-					showarrow=False,
-					font_size=30,
-					font_color='cyan', 
-					bordercolor="gray",
-					bgcolor="gray",
-					opacity=0.8),
-
-			' (Day) Cloud Phase': px.imshow(
-				m1_data.rgb.DayCloudPhase())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed')
-				.add_annotation(
-					x=0.5,
-					y=0.5,
-					text=f'No Mesoscale Image<br>of {storm_name}<br>at This Time',
-					xref='paper',
-					yref='paper',
-					showarrow=False,
-					font_size=30,
-					font_color='cyan', 
-					bordercolor="gray",
-					bgcolor="gray",
-					opacity=0.8),
-
-			' Air Mass': px.imshow(
-				m1_data.rgb.AirMass())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed')
-				.add_annotation(
-					x=0.5,
-					y=0.5,
-					text=f'No Mesoscale Image<br>of {storm_name}<br>at This Time',
-					xref='paper',
-					yref='paper',
-					showarrow=False,
-					font_size=30,
-					font_color='cyan', 
-					bordercolor="gray",
-					bgcolor="gray",
-					opacity=0.8),
-
-			' Water Vapor': px.imshow(
-				m1_data.rgb.WaterVapor())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed')
-				.add_annotation(
-					x=0.5,
-					y=0.5,
-					text=f'No Mesoscale Image<br>of {storm_name}<br>at This Time',
-					xref='paper',
-					yref='paper',
-					showarrow=False,
-					font_size=30,
-					font_color='cyan', 
-					bordercolor="gray",
-					bgcolor="gray",
-					opacity=0.8),
-
-			' Differential Water Vapor': px.imshow(
-				m1_data.rgb.DifferentialWaterVapor())
-				.update_layout(margin=dict(l=10, r=10, b=10, t=10))
-				.update_traces(hovertemplate=None, hoverinfo='skip')
-				.update_xaxes(visible=False)
-				.update_yaxes(visible=False, autorange='reversed')
-				.add_annotation(
-					x=0.5,
-					y=0.5,
-					text=f'No Mesoscale Image<br>of {storm_name}<br>at This Time',
-					xref='paper',
-					yref='paper',
-					showarrow=False,
-					font_size=30,
-					font_color='cyan', 
-					bordercolor="gray",
-					bgcolor="gray",
-					opacity=0.8),
-		}
-
-	map_fig.update_geos(projection_type="orthographic",
-					showcoastlines=False,
-					landcolor='#212121',
-					framecolor='#20324f',
-					showocean=True,
-					showlakes=True,
-					lakecolor='#20324f',
-					oceancolor='#20447a',
-					projection_rotation=dict(
-						lon=df['lon'][selected_time],
-						lat=df['lat'][selected_time]
-						))
-	
-	map_fig.update_layout(margin=dict(l=10, r=10, b=10, t=10), height=300)
-	map_fig.update_traces(hovertemplate=None, hoverinfo='skip')
-			
 	surface_fig.update_layout(
 					autosize=True,
 					dragmode = 'turntable',
@@ -703,25 +389,55 @@ def update_graphs(storm_name, selected_time):
 	)
 	surface_fig.update_traces(hovertemplate=None, hoverinfo='skip')
 	
-	plotting_end = time.time()
-	print(f'Total graphing time: \n\t{plotting_end - plotting_start}\n')
-
-	return map_fig, surface_fig, dash.no_update, rgb, dash.no_update
+	# Warm the neighbouring time steps while the user looks at this one
+	shown = [sector, other] if side_by_side else [sector]
+	prefetcher.schedule(storm_name, [list(df[s]) for s in shown], selected_time,
+						[(channel_variables((13,)), False),
+						 (mode_variables(rgb_selection), uses_lut(rgb_selection))],
+						session=session_id)
+
+	return map_fig, surface_fig, dash.no_update, rgb, dash.no_update, storm_name
 	
 @app.callback(
 	Output('image-graph', 'figure'),
+	Output('rgb-factor', 'data'),
 	Input('rgb-store', 'data'),
-	Input('rgb-selector', 'value')	
+	Input('rgb-selector', 'value'),
+	Input('side-by-side', 'value'),
+	Input('image-graph', 'relayoutData'),
+	State('viewport', 'data'),
+	State('rgb-factor', 'data'),
+	State('session-id', 'data'),
 )
 	
-def update_rgb(rgb, rgb_selection):
-	rgb_update_start = time.time()
+@trace('update_rgb')
+def update_rgb(rgb, rgb_selection, side_by_side, relayout, viewport, sent_factor, session_id):
+	from granules import resolve_granules
+	from render import render_rgb, render_pair
+	from viewport import output_factor, is_zoomed, is_view_change
+
 	if not rgb:
 		raise PreventUpdate
-	
-	fig = rgb[rgb_selection]
 
-	return fig
+	# Built at the panel's resolution; zooming in swaps in full resolution,
+	# and zooming back out the reduced image again. Pans and zooms that
+	# keep the resolution already sent (rgb-factor) leave the figure be.
+	sectors = resolve_granules(rgb['sectors']) if side_by_side else None
+	pair = bool(sectors) and all(sectors)
+	reduced = output_factor(rgb['shape'], viewport, panels=2 if pair else 1)
+	factor = 1 if is_zoomed(relayout) else reduced
+	if relayout and dash.ctx.triggered_id == 'image-graph' and (
+			factor == sent_factor or not is_view_change(relayout)):
+		raise PreventUpdate
+
+	token = generations.begin(session_id, 'rgb')
+	checkpoint = lambda: generations.check(token)
+	if pair:
+		fig = render_pair(sectors, rgb_selection, rgb['note'], checkpoint=checkpoint, factor=factor)
+	else:
+		fig = render_rgb(rgb['granule'], rgb_selection, rgb['note'], checkpoint=checkpoint,
+						 window=rgb['window'], factor=factor)
+	return fig, factor
 
 @app.callback(
 	Output('download-png', 'data'),
@@ -759,10 +475,10 @@ def func(n_clicks):
 )
 
 def update_slider(storm_name):
-	df = storm_dataset[storm_dataset['storm_name'].eq(storm_name)].reset_index(drop=True)
-	min=df.index.min()
-	max=df.index.max()
-	value=df.index.min()
+	df = storm_catalog.storm(storm_name)
+	min=0
+	max=len(df) - 1
+	value=0
 
 	return min, max, value
 
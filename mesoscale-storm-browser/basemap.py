@@ -0,0 +1,92 @@
+import copy
+from functools import lru_cache
+
+# Trace order of the map figure
+WINDOW_1, WINDOW_2, STORM_PATH, STORM_MARKER = range(4)
+
+
+@lru_cache(maxsize=16)
+def base_map(catalog, storm_name):
+
+    # Everything on the map that stays put across a storm's time steps: the
+    # styled globe and the storm path. The windows and storm marker start
+    # empty and are filled in by map_step().
+    import plotly.graph_objects as go
+
+    df = catalog.storm(storm_name)
+    fig = go.Figure()
+    fig.add_trace(go.Scattergeo(
+                name='Window 1',
+                mode='lines',
+                line=dict(color='purple'),
+                fill='toself'))
+    fig.add_trace(go.Scattergeo(
+                name='Window 2',
+                mode='lines',
+                line=dict(color='orange'),
+                fill='toself'))
+    fig.add_trace(go.Scattergeo(
+                name='Storm Path',
+                lon=df['lon'],
+                lat=df['lat'],
+                mode='lines',
+                line=dict(width=1, color='white'),
+                opacity=0.8))
+    fig.add_trace(go.Scattergeo(
+                name=storm_name,
+                mode='markers',
+                marker=dict(size=8, color='white', symbol='200'),
+                opacity=0.8))
+
+    fig.update_geos(projection_type="orthographic",
+                    showcoastlines=False,
+                    landcolor='#212121',
+                    framecolor='#20324f',
+                    showocean=True,
+                    showlakes=True,
+                    lakecolor='#20324f',
+                    oceancolor='#20447a')
+    fig.update_layout(margin=dict(l=10, r=10, b=10, t=10), height=300)
+    fig.update_traces(hovertemplate=None, hoverinfo='skip')
+    return fig.to_dict()
+
+
+def map_step(df, t):
+
+    # The map properties that change between time steps, as (path, value)
+    # pairs into the figure
+    n1, e1, s1, w1 = (float(df[c][t]) for c in ('n1', 'e1', 's1', 'w1'))
+    n2, e2, s2, w2 = (float(df[c][t]) for c in ('n2', 'e2', 's2', 'w2'))
+    lon, lat = float(df['lon'][t]), float(df['lat'][t])
+    return [
+        (('data', WINDOW_1, 'lon'), [e1, e1, w1, w1, e1]),
+        (('data', WINDOW_1, 'lat'), [n1, s1, s1, n1, n1]),
+        (('data', WINDOW_2, 'lon'), [e2, e2, w2, w2, e2]),
+        (('data', WINDOW_2, 'lat'), [n2, s2, s2, n2, n2]),
+        (('data', STORM_MARKER, 'lon'), [lon]),
+        (('data', STORM_MARKER, 'lat'), [lat]),
+        (('layout', 'geo', 'projection', 'rotation'), dict(lon=lon, lat=lat)),
+    ]
+
+
+def apply_step(target, changes):
+
+    # Works on a figure dict and on a dash.Patch alike
+    for path, value in changes:
+        node = target
+        for k in path[:-1]:
+            node = node[k]
+        node[path[-1]] = value
+    return target
+
+
+def map_figure(catalog, storm_name, t, shown=None):
+
+    # The map for time step t. When the browser already shows this storm's
+    # map (shown, from the map-storm store) only the changed properties are
+    # sent, as a Patch; otherwise the cached base figure with them applied.
+    changes = map_step(catalog.storm(storm_name), t)
+    if shown == storm_name:
+        from dash import Patch
+        return apply_step(Patch(), changes)
+    return apply_step(copy.deepcopy(base_map(catalog, storm_name)), changes)
@@ -0,0 +1,523 @@
+"""Offline benchmarks for the storm browser.
+
+Writes synthetic MCMIPM granules (500 x 500 at 2 km, 16 packed CMI bands
+with their DQF planes, GOES-East fixed grid projection attributes), serves
+them from a local S3 stand-in, and times each stage of a request on its own:
+key resolution, open, decode, every compositor in rgb.py and its fast
+paths, figure build and JSON serialization, then the full update_graphs
+and update_rgb callbacks against a one-storm catalog of those granules.
+
+    python bench.py -o bench.json
+    python bench.py --stages 'decode*,lut:*' --repeat 20
+    python bench.py --compare base.json bench.json
+
+Results are JSON: per-stage run times plus the commit and package versions
+they were measured on. --compare prints the change in median per stage and
+exits non-zero when any stage is slower than --threshold times the base.
+
+The stand-in is moto's S3 server (pip install "moto[server]"); --endpoint
+uses an already running S3-compatible server instead.
+"""
+import argparse
+import fnmatch
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BUCKET = 'noaa-goes16'
+STORM_ID = 'bench01'
+STORM_NAME = 'Synthetic Storm'
+START = datetime(2021, 8, 29, 14, 0)
+
+# Mesoscale sector over the Gulf of Mexico: scan angle of the centre pixel
+# and the 2 km MCMIP pixel pitch, in radians
+SECTOR_CENTRE = (-0.0392, 0.0784)
+PIXEL_PITCH = 5.6e-05
+
+# GOES-East fixed grid, as in the goes_imager_projection variable
+PROJECTION = {
+    'long_name': 'GOES-R ABI fixed grid projection',
+    'grid_mapping_name': 'geostationary',
+    'perspective_point_height': 35786023.0,
+    'semi_major_axis': 6378137.0,
+    'semi_minor_axis': 6356752.31414,
+    'inverse_flattening': 298.2572221,
+    'latitude_of_projection_origin': 0.0,
+    'longitude_of_projection_origin': -75.0,
+    'sweep_angle_axis': 'x',
+}
+
+# Band -> (units, scale_factor, add_offset) of the packed CMI counts
+CMI_PACKING = {
+    1: ('1', 0.00031746, 0.0),
+    2: ('1', 0.00031746, 0.0),
+    3: ('1', 0.00031746, 0.0),
+    4: ('1', 0.00031746, 0.0),
+    5: ('1', 0.00031746, 0.0),
+    6: ('1', 0.00031746, 0.0),
+    7: ('K', 0.05311, 197.31),
+    8: ('K', 0.02257, 138.05),
+    9: ('K', 0.02171, 137.70),
+    10: ('K', 0.02431, 126.91),
+    11: ('K', 0.03857, 127.69),
+    12: ('K', 0.02773, 117.49),
+    13: ('K', 0.06145, 89.62),
+    14: ('K', 0.05961, 96.19),
+    15: ('K', 0.06075, 97.38),
+    16: ('K', 0.04385, 92.70),
+}
+
+GLOBAL_ATTRS = {
+    'title': 'ABI L2 Cloud and Moisture Imagery',
+    'orbital_slot': 'GOES-East',
+    'platform_ID': 'G16',
+    'instrument_type': 'GOES R Series Advanced Baseline Imager',
+    'scene_id': 'Mesoscale',
+    'spatial_resolution': '2km at nadir',
+}
+
+
+def granule_key(start, sector=1):
+
+    # Same layout as the NOAA bucket; the catalog stores everything up to
+    # the start minute as the prefix
+    s = f'{start:%Y%j%H%M%S}0'
+    e = f'{start + timedelta(seconds=57):%Y%j%H%M%S}0'
+    c = f'{start + timedelta(seconds=64):%Y%j%H%M%S}0'
+    name = f'OR_ABI-L2-MCMIPM{sector}-M6_G16_s{s}_e{e}_c{c}.nc'
+    return f'{BUCKET}/ABI-L2-MCMIPM/{start:%Y/%j/%H}/{name}'
+
+
+def granule_prefix(key):
+
+    return 's3://' + key[:key.index('_s') + 14]
+
+
+def storm_fields(size, step, seed):
+
+    # A cold, slowly rotating spiral over warm ocean with some texture, so
+    # the counts compress about as well as a real scene does
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[-1:1:size * 1j, -1:1:size * 1j]
+    r = np.hypot(xx, yy)
+    theta = np.arctan2(yy, xx)
+    bands = 0.5 + 0.5 * np.cos(3 * theta - 9 * r + 0.05 * step)
+    cloud = np.exp(-(r / 0.3)**2) + 0.7 * bands * np.exp(-(r / 0.8)**2)
+    cloud = np.clip(cloud + rng.normal(0, 0.03, cloud.shape), 0, 1)
+    return cloud, rng
+
+
+def band_values(band, cloud, rng):
+
+    noise = rng.normal(0, 1, cloud.shape)
+    if band <= 6:
+        # Reflectance factor: dark ocean, bright cloud tops
+        return np.clip(0.04 + 0.8 * cloud + 0.01 * noise, 0, 1.2)
+    if band in (8, 9, 10):
+        # Water vapor bands sit high and cold even in clear sky
+        return 250 - (35 + 5 * (band - 8)) * cloud + 0.5 * noise
+    return 298 - 110 * cloud + 0.3 * noise
+
+
+def synthetic_granule(start, size=500, sector=1, step=0, seed=0):
+
+    import xarray as xr
+
+    from geoloc import fixed_grid_latlon
+
+    x0, y0 = SECTOR_CENTRE
+    offsets = (np.arange(size) - size // 2) * PIXEL_PITCH
+    x = (x0 + offsets).astype(np.float32)
+    y = (y0 - offsets).astype(np.float32)
+
+    cloud, rng = storm_fields(size, step, seed)
+    variables = {}
+    for band, (units, scale, offset) in CMI_PACKING.items():
+        values = band_values(band, cloud, rng)
+        packed = np.clip(np.round((values - offset) / scale), 0, 4094).astype(np.uint16)
+        variables[f'CMI_C{band:02d}'] = xr.Variable(('y', 'x'), packed.view(np.int16), attrs={
+            'long_name': f'ABI L2+ Cloud and Moisture Imagery {"reflectance" if units == "1" else "brightness temperature"}',
+            'units': units,
+            'scale_factor': np.float32(scale),
+            'add_offset': np.float32(offset),
+            '_Unsigned': 'true',
+            '_FillValue': np.int16(-1),
+            'grid_mapping': 'goes_imager_projection',
+        })
+        dqf = (rng.random((size, size)) < 0.002).astype(np.int8)
+        variables[f'DQF_C{band:02d}'] = xr.Variable(('y', 'x'), dqf, attrs={
+            '_FillValue': np.int8(-1), '_Unsigned': 'true'})
+
+    lat, lon = fixed_grid_latlon(x, y, PROJECTION['semi_major_axis'], PROJECTION['semi_minor_axis'],
+                                 PROJECTION['longitude_of_projection_origin'],
+                                 PROJECTION['perspective_point_height'])
+    extent = {
+        'geospatial_westbound_longitude': float(np.nanmin(lon)),
+        'geospatial_eastbound_longitude': float(np.nanmax(lon)),
+        'geospatial_northbound_latitude': float(np.nanmax(lat)),
+        'geospatial_southbound_latitude': float(np.nanmin(lat)),
+        'geospatial_lat_center': float(lat[size // 2, size // 2]),
+        'geospatial_lon_center': float(lon[size // 2, size // 2]),
+    }
+    variables['goes_imager_projection'] = xr.Variable((), np.int32(-2147483647), attrs=PROJECTION)
+    variables['geospatial_lat_lon_extent'] = xr.Variable((), np.float32(9.96921e36), attrs=extent)
+
+    ds = xr.Dataset(variables, coords={'x': ('x', x), 'y': ('y', y), 't': np.datetime64(start, 'ns')})
+    ds.attrs.update(GLOBAL_ATTRS, time_coverage_start=f'{start:%Y-%m-%dT%H:%M:%S.0Z}')
+    return ds, extent
+
+
+def write_granules(workdir, count, size=500, seed=0):
+
+    # Granules already on disk are reused; generating them is the slow part
+    granules = []
+    for step in range(count):
+        start = START + timedelta(minutes=step)
+        key = granule_key(start)
+        path = os.path.join(workdir, 'granules', key)
+        extent_path = path + '.extent.json'
+        if not os.path.exists(path) or not os.path.exists(extent_path):
+            ds, extent = synthetic_granule(start, size=size, step=step, seed=seed + step)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            encoding = {v: {'zlib': True, 'complevel': 1, 'chunksizes': (size // 2, size // 2)}
+                        for v in ds.data_vars if ds[v].ndim == 2}
+            encoding['x'] = {'dtype': 'int16', 'scale_factor': PIXEL_PITCH, 'add_offset': SECTOR_CENTRE[0]}
+            encoding['y'] = {'dtype': 'int16', 'scale_factor': -PIXEL_PITCH, 'add_offset': SECTOR_CENTRE[1]}
+            ds.to_netcdf(path + '.tmp', engine='h5netcdf', encoding=encoding)
+            os.replace(path + '.tmp', path)
+            with open(extent_path, 'w') as f:
+                json.dump(extent, f)
+        with open(extent_path) as f:
+            granules.append((start, key, path, json.load(f)))
+    return granules
+
+
+def write_catalog(workdir, granules):
+
+    # One storm sitting in the middle of mesoscale window 1 at every step
+    import csv
+
+    rows = []
+    for start, key, _, extent in granules:
+        n, s = extent['geospatial_northbound_latitude'], extent['geospatial_southbound_latitude']
+        e, w = extent['geospatial_eastbound_longitude'], extent['geospatial_westbound_longitude']
+        rows.append({
+            'storm_id': STORM_ID,
+            'storm_name': STORM_NAME,
+            'timestamp': f'{start:%Y-%m-%d %H:%M:%S}',
+            'timecode': f'{start:%Y%j%H%M}',
+            'lat': extent['geospatial_lat_center'],
+            'lon': extent['geospatial_lon_center'],
+            'm1_combined': granule_prefix(key),
+            'm1_c13': '',
+            'm2_combined': '',
+            'm2_c13': '',
+            'n1': n, 'e1': e, 's1': s, 'w1': w,
+            'n2': n - 20, 'e2': e - 20, 's2': s - 20, 'w2': w - 20,
+        })
+    path = os.path.join(workdir, 'data', 'storm_data.csv')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def start_s3(port):
+
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit('bench.py needs moto for the local S3 stand-in: pip install "moto[server]" '
+                 '(or pass --endpoint to use a running S3-compatible server)')
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    return server, f'http://127.0.0.1:{port}'
+
+
+def upload(endpoint, granules):
+
+    import s3fs
+
+    fs = s3fs.S3FileSystem(key='bench', secret='bench', client_kwargs={'endpoint_url': endpoint})
+    if not fs.exists(BUCKET):
+        fs.mkdir(BUCKET)
+    for _, key, path, _ in granules:
+        if not fs.exists(key):
+            fs.put(path, key)
+
+
+class Runner:
+
+    # Times stages selected by --stages and collects their results
+
+    def __init__(self, repeat, patterns=None):
+        self.repeat = repeat
+        self.patterns = patterns
+        self.results = {}
+
+    def selected(self, name):
+        return not self.patterns or any(fnmatch.fnmatchcase(name, p) for p in self.patterns)
+
+    def measure(self, name, fn, setup=None, repeat=None):
+
+        if not self.selected(name):
+            return None
+        from metrics import registry
+
+        runs, read = [], []
+        value = None
+        try:
+            for _ in range(repeat or self.repeat):
+                if setup:
+                    setup()
+                before = registry.total_bytes()
+                start = time.perf_counter()
+                value = fn()
+                runs.append(time.perf_counter() - start)
+                read.append(registry.total_bytes() - before)
+        except Exception as e:
+            self.results[name] = {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+            print(f'{name:48s} error: {type(e).__name__}: {e}')
+            return None
+        self.results[name] = {
+            'status': 'ok',
+            'runs': runs,
+            'min': min(runs),
+            'median': statistics.median(runs),
+            'mean': statistics.fmean(runs),
+            'max': max(runs),
+            # Granule bytes read per run (storm_browser_read_bytes_total)
+            'read_bytes': statistics.median(read),
+        }
+        print(f'{name:48s} {statistics.median(runs) * 1000:10.2f} ms {statistics.median(read) / 1e6:8.2f} MB')
+        return value
+
+
+def run_stages(runner, granules):
+
+    # Imported here: the environment has to point granules.py at the
+    # stand-in before it is first loaded
+    import plotly.io as pio
+
+    import rgb
+    from composite import KERNELS, composite
+    from granules import close_granules, get_store, resolve_granule, open_granule, load_granule
+    from lut import lut_composite
+    from render import RGB_MODES, make_rgb_fig, mode_variables, uses_lut
+    from surface import surface_grid, SURFACE_CORE
+
+    _, key, _, _ = granules[0]
+    prefix = granule_prefix(key)
+    all_bands = rgb.channel_variables(range(1, 17))
+    c13 = rgb.channel_variables((13,))
+
+    def cold():
+        close_granules()
+        get_store().invalidate_cache()
+
+    def opened():
+        close_granules()
+        open_granule(key)
+
+    def opened_raw():
+        close_granules()
+        open_granule(key, True)
+
+    runner.measure('resolve', lambda: resolve_granule(prefix), setup=get_store().invalidate_cache)
+    runner.measure('open', lambda: open_granule(key), setup=cold)
+    runner.measure('decode:all', lambda: load_granule(key, all_bands), setup=opened)
+    runner.measure('decode:C13', lambda: load_granule(key, c13), setup=opened)
+    runner.measure('decode raw:all', lambda: load_granule(key, all_bands, raw=True), setup=opened_raw)
+
+    C = load_granule(key, all_bands)
+    R = load_granule(key, all_bands, raw=True)
+
+    runner.measure('surface', lambda: surface_grid(C.x, C.y, C.CMI_C13, core=SURFACE_CORE))
+    for recipe in rgb.RGB_CHANNELS:
+        runner.measure(f'rgb:{recipe}', lambda: getattr(rgb, recipe)(C))
+    for recipe in KERNELS:
+        runner.measure(f'composite:{recipe}', lambda: composite(C, recipe))
+        runner.measure(f'lut:{recipe}', lambda: lut_composite(R, recipe))
+
+    for mode in RGB_MODES:
+        label = mode.strip()
+        raw = uses_lut(mode)
+        ds = load_granule(key, mode_variables(mode), raw=raw)
+        fig = runner.measure(f'figure:{label}', lambda: make_rgb_fig(ds, mode, raw=raw))
+        if fig is not None:
+            runner.measure(f'json:{label}', lambda: pio.to_json(fig, validate=False))
+
+
+def run_callbacks(runner, granules):
+
+    from render import RGB_MODES, figure_store
+
+    names = (['update_graphs:cold', 'update_graphs:warm', 'update_graphs:crop', 'map:full', 'map:patch'] +
+             [f'update_rgb:{m.strip()}' for m in RGB_MODES])
+    if not any(runner.selected(name) for name in names):
+        return
+
+    import app
+    from granules import clear_granules, get_store
+
+    mode = ' Enhanced IR'
+    crop = [' Zoom to Storm Centre']
+    steps = itertools.cycle(range(len(granules)))
+
+    def cold():
+        clear_granules()
+        get_store().invalidate_cache()
+
+    def update_graphs(step, crop=()):
+        # The browser already shows this storm's map, as it does on a slider step
+        return app.update_graphs(STORM_NAME, step, list(crop), mode, [], 'bench', STORM_NAME)
+
+    # Cold: a time step whose granule is not open yet; warm: the same step
+    # again, which is what a re-render after a mode change costs; crop: a
+    # cold step read through the storm-centred window
+    runner.measure('update_graphs:cold', lambda: update_graphs(next(steps)), setup=cold)
+    if runner.selected('update_graphs:warm'):
+        update_graphs(0)
+    runner.measure('update_graphs:warm', lambda: update_graphs(0))
+    runner.measure('update_graphs:crop', lambda: update_graphs(next(steps), crop), setup=cold)
+
+    # Map on a storm change (cached base figure) and on a slider step (Patch)
+    from basemap import map_figure
+    runner.measure('map:full', lambda: map_figure(app.storm_catalog, STORM_NAME, next(steps)))
+    runner.measure('map:patch', lambda: map_figure(app.storm_catalog, STORM_NAME, next(steps), shown=STORM_NAME))
+
+    rgb = {'granule': granules[0][1], 'note': None, 'window': None, 'shape': [500, 500], 'sectors': []}
+    for mode in RGB_MODES:
+        runner.measure(f'update_rgb:{mode.strip()}', lambda: app.update_rgb(rgb, mode, [], None, None, None, 'bench'),
+                       setup=figure_store.clear)
+
+
+def environment(workdir, size, count):
+
+    from importlib import metadata
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=SCRIPT_DIR).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True,
+                                    cwd=SCRIPT_DIR).stdout.strip())
+    except OSError:
+        commit, dirty = '', False
+
+    versions = {}
+    for package in ['numpy', 'xarray', 'h5netcdf', 'h5py', 's3fs', 'fsspec', 'plotly', 'dash', 'moto']:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'packages': versions,
+        'granule': {
+            'size': size,
+            'count': count,
+            'bytes': os.path.getsize(os.path.join(workdir, 'granules', granule_key(START))),
+        },
+    }
+
+
+def compare(base_path, head_path, threshold):
+
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+
+    print(f'base {base["environment"]["commit"][:10]}  head {head["environment"]["commit"][:10]}')
+    regressions = []
+    for name in sorted(set(base['stages']) | set(head['stages'])):
+        b = base['stages'].get(name, {})
+        h = head['stages'].get(name, {})
+        if b.get('status') != 'ok' or h.get('status') != 'ok':
+            print(f'{name:48s} {b.get("status", "-"):>10s} {h.get("status", "-"):>10s}')
+            continue
+        ratio = h['median'] / b['median']
+        flag = ''
+        if ratio > threshold:
+            flag = '  slower'
+            regressions.append(name)
+        print(f'{name:48s} {b["median"] * 1000:10.2f} {h["median"] * 1000:10.2f} ms  x{ratio:.2f}{flag}')
+    return 1 if regressions else 0
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', default='bench.json')
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    parser.add_argument('--stages', help='comma-separated glob patterns of stages to run')
+    parser.add_argument('--granules', type=int, default=6, help='time steps in the synthetic storm')
+    parser.add_argument('--size', type=int, default=500, help='granule width and height in pixels')
+    parser.add_argument('--workdir', help='where granules and the catalog are kept (default: a new temp dir)')
+    parser.add_argument('--endpoint', help='S3-compatible endpoint to use instead of starting moto')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'))
+    parser.add_argument('--threshold', type=float, default=1.10)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    output = os.path.abspath(args.output)
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='storm-bench-'))
+    granules = write_granules(workdir, args.granules, size=args.size)
+    write_catalog(workdir, granules)
+
+    server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        server, endpoint = start_s3(args.port)
+    try:
+        upload(endpoint, granules)
+
+        # The app modules read data/ relative to the working directory and
+        # pick up these settings at import time
+        os.chdir(workdir)
+        os.environ.update(GRANULE_STORE='s3', S3_ENDPOINT_URL=endpoint, WARMUP='0', PREFETCH_WINDOW='0')
+        os.environ.pop('GEOLOC_CACHE_DIR', None)
+        os.environ.pop('FIGURE_SPILL_DIR', None)
+
+        runner = Runner(args.repeat, args.stages.split(',') if args.stages else None)
+        run_stages(runner, granules)
+        run_callbacks(runner, granules)
+    finally:
+        if server is not None:
+            server.stop()
+
+    results = {
+        'environment': environment(workdir, args.size, args.granules),
+        'repeat': args.repeat,
+        'stages': runner.results,
+    }
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Compiled, storm-indexed catalog.
+
+The storm CSV is compiled once into a directory of .npy columns with the
+rows grouped by storm, plus the storm names and their row offsets. Loading
+memory-maps the columns, and catalog.storm(name) is a dict lookup returning
+zero-copy slices, in place of filtering a DataFrame on every callback.
+
+Which mesoscale window holds the storm centre (window: 1, 2 or 0) and the
+signed distance to each window's edge (m1_edge_km, m2_edge_km) are computed
+for every row at build time, so requests need no geometry.
+
+    python catalog.py data/storm_data.csv -o data/storm_catalog
+"""
+import argparse
+import os
+
+import numpy as np
+
+# The storm CSV every tool reads by default
+CATALOG_CSV = os.environ.get('STORM_CSV', 'data/storm_data.csv')
+CATALOG_DIR = 'data/storm_catalog'
+# Bump when build_catalog output changes so older catalogs get rebuilt
+CATALOG_VERSION = '2'
+
+# Columns the app reads as numbers; everything else is kept as strings
+FLOAT_COLUMNS = ['lon', 'lat', 'n1', 'e1', 's1', 'w1', 'n2', 'e2', 's2', 'w2']
+
+KM_PER_DEGREE = 111.2
+
+
+def edge_distance_km(lon, lat, n, e, s, w):
+
+    # Signed distance from the storm centre to the nearest edge of a
+    # lat/lon box: positive strictly inside, negative outside (the outside
+    # value is the largest edge violation, not the exact distance)
+    kx = KM_PER_DEGREE * np.cos(np.radians(lat))
+    return np.minimum.reduce([(lon - np.minimum(w, e)) * kx,
+                              (np.maximum(w, e) - lon) * kx,
+                              (lat - np.minimum(s, n)) * KM_PER_DEGREE,
+                              (np.maximum(s, n) - lat) * KM_PER_DEGREE])
+
+
+def classify_windows(c):
+
+    # Which mesoscale window holds the storm centre: 1, 2 (if not in 1) or
+    # 0 for neither, as the per-request Shapely within() test decided it
+    m1 = edge_distance_km(c['lon'], c['lat'], c['n1'], c['e1'], c['s1'], c['w1'])
+    m2 = edge_distance_km(c['lon'], c['lat'], c['n2'], c['e2'], c['s2'], c['w2'])
+    window = np.where(m1 > 0, 1, np.where(m2 > 0, 2, 0)).astype(np.int8)
+    return {'window': window, 'm1_edge_km': m1, 'm2_edge_km': m2}
+
+
+def _save(path, write):
+
+    # Each file is written under a temporary name and renamed into place, so
+    # workers compiling the catalog at the same time never read a torn file
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def build_catalog(csv_path=CATALOG_CSV, out_dir=CATALOG_DIR):
+
+    import pandas as pd
+
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    missing = [c for c in FLOAT_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f'{csv_path} has no {", ".join(missing)} column(s): the catalog needs the '
+                         f'storm centre and both mesoscale window bounds')
+
+    # Group rows by storm in order of first appearance, keeping each storm's
+    # rows in file order (what the per-callback filter used to give)
+    codes, storms = pd.factorize(df['storm_name'])
+    order = np.argsort(codes, kind='stable')
+    offsets = np.searchsorted(codes[order], np.arange(len(storms) + 1)).astype(np.int64)
+
+    columns = {}
+    for column in df.columns:
+        values = df[column].to_numpy()[order]
+        if column in FLOAT_COLUMNS:
+            values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(np.float64)
+        else:
+            values = values.astype(str)
+        columns[column] = values
+    with np.errstate(invalid='ignore'):
+        columns.update(classify_windows(columns))
+
+    os.makedirs(out_dir, exist_ok=True)
+    for column, values in columns.items():
+        _save(os.path.join(out_dir, f'{column}.npy'), lambda f: np.save(f, values))
+    _save(os.path.join(out_dir, '_storms.npy'), lambda f: np.save(f, np.asarray(storms, dtype=str)))
+    _save(os.path.join(out_dir, '_version.txt'), lambda f: f.write(CATALOG_VERSION.encode()))
+    # Written last: its presence marks a complete catalog
+    _save(os.path.join(out_dir, '_offsets.npy'), lambda f: np.save(f, offsets))
+
+    return out_dir
+
+
+class StormRows:
+
+    # One storm's rows; columns are read-only views into the catalog
+
+    def __init__(self, catalog, start, stop):
+        self._catalog = catalog
+        self.rows = slice(start, stop)
+
+    def __len__(self):
+        return self.rows.stop - self.rows.start
+
+    def __getitem__(self, column):
+        return self._catalog.column(column)[self.rows]
+
+    def __contains__(self, column):
+        return column in self._catalog.columns
+
+
+class StormCatalog:
+
+    def __init__(self, path=CATALOG_DIR):
+        self.path = path
+        self.storm_list = np.load(os.path.join(path, '_storms.npy')).tolist()
+        offsets = np.load(os.path.join(path, '_offsets.npy'))
+        self._storms = {name: (int(offsets[i]), int(offsets[i + 1]))
+                        for i, name in enumerate(self.storm_list)}
+        self.columns = sorted(f[:-4] for f in os.listdir(path)
+                              if f.endswith('.npy') and not f.startswith('_'))
+        self._columns = {}
+
+    def __len__(self):
+        return sum(stop - start for start, stop in self._storms.values())
+
+    def column(self, name):
+        array = self._columns.get(name)
+        if array is None:
+            array = self._columns[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return array
+
+    def storm(self, storm_name):
+        return StormRows(self, *self._storms[storm_name])
+
+
+def load_catalog(csv_path=CATALOG_CSV, path=CATALOG_DIR):
+
+    # Compile the catalog on first use, when the CSV is newer, or when it
+    # was built by an older version of build_catalog
+    offsets = os.path.join(path, '_offsets.npy')
+    version = os.path.join(path, '_version.txt')
+    if (not os.path.exists(offsets) or
+            not os.path.exists(version) or open(version).read().strip() != CATALOG_VERSION or
+            (os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(offsets))):
+        build_catalog(csv_path, path)
+    catalog = StormCatalog(path)
+
+    # The app draws and classifies the mesoscale windows on every request;
+    # fail here rather than with a missing column inside a callback
+    missing = [c for c in FLOAT_COLUMNS + ['window'] if c not in catalog.columns]
+    if missing:
+        raise ValueError(f'Storm catalog {path} (from {csv_path}) has no {", ".join(missing)} '
+                         f'column(s): set STORM_CSV to a storm CSV with the mesoscale window bounds')
+    return catalog
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('csv', nargs='?', default=CATALOG_CSV)
+    parser.add_argument('-o', '--output', default=CATALOG_DIR)
+    args = parser.parse_args()
+    print(build_catalog(args.csv, args.output))
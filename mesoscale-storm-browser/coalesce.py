@@ -0,0 +1,38 @@
+import threading
+from collections import OrderedDict
+
+from dash.exceptions import PreventUpdate
+
+
+class Superseded(PreventUpdate):
+    pass
+
+
+class Generations:
+
+    # Per-session request counters. Each callback run takes a token with
+    # begin() and calls check() at its stage boundaries; once a newer run
+    # has started for the same session and channel, check() raises
+    # Superseded, which Dash treats as "no update".
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._gens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(self, session, channel=None):
+        key = (session, channel)
+        with self._lock:
+            gen = self._gens.pop(key, 0) + 1
+            self._gens[key] = gen
+            while len(self._gens) > self.max_sessions:
+                self._gens.popitem(last=False)
+        return key, gen
+
+    def current(self, token):
+        key, gen = token
+        return self._gens.get(key) == gen
+
+    def check(self, token):
+        if not self.current(token):
+            raise Superseded
@@ -0,0 +1,250 @@
+"""Float32 compositing engine for the recipes in rgb.py.
+
+Every recipe is evaluated as one fused kernel per block of rows: channels are
+copied into per-thread float32 scratch planes, all arithmetic is done in
+place with out= arguments, and results are written straight into a single
+preallocated (y, x, 3) float32 image. Row blocks are sized to stay in cache
+and are spread over a thread pool (numpy releases the GIL in ufuncs).
+
+Results match the float64 functions in rgb.py to float32 precision.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from rgb import RGB_CHANNELS, rgb_as_dataset
+
+# Bytes per scratch plane; four planes per thread should sit in L2
+BLOCK_BYTES = 256 * 1024
+COMPOSITE_THREADS = int(os.environ.get('COMPOSITE_THREADS', os.cpu_count() or 1))
+
+_pool = ThreadPoolExecutor(max_workers=COMPOSITE_THREADS, thread_name_prefix='composite')
+_local = threading.local()
+
+
+def _scratch(rows, nx, count=4):
+
+    bufs = getattr(_local, 'bufs', None)
+    if bufs is None or bufs.shape[1] < rows or bufs.shape[2] != nx:
+        bufs = _local.bufs = np.empty((count, rows, nx), dtype=np.float32)
+    return bufs
+
+
+class _Block:
+
+    # Row window onto the channels of one granule
+
+    def __init__(self, channels, rows):
+        self.channels = channels
+        self.rows = rows
+
+    def raw(self, c, out):
+        data, _ = self.channels[c]
+        np.copyto(out, data[self.rows], casting='same_kind')
+        return out
+
+    def channel(self, c, out):
+        # Same units handling as rgb.load_RGB_channels: Kelvin -> Celsius
+        data, units = self.channels[c]
+        self.raw(c, out)
+        if units == 'K':
+            np.subtract(out, 273.15, out=out)
+        return out
+
+    def difference(self, a, b, out, tmp):
+        self.raw(a, out)
+        np.subtract(out, self.raw(b, tmp), out=out)
+        return out
+
+
+def _normalize(a, lower_limit, upper_limit, clip=True):
+    np.subtract(a, lower_limit, out=a)
+    np.divide(a, upper_limit - lower_limit, out=a)
+    if clip:
+        np.clip(a, 0, 1, out=a)
+    return a
+
+
+def _gamma(a, gamma, out=None):
+    return np.power(a, 1 / gamma, out=a if out is None else out)
+
+
+def _invert(a, out=None):
+    return np.subtract(1, a, out=a if out is None else out)
+
+
+def _pseudo_green(R, G, B, tmp):
+    np.multiply(G, 0.1, out=G)
+    G += np.multiply(R, 0.45, out=tmp)
+    G += np.multiply(B, 0.45, out=tmp)
+    return np.clip(G, 0, 1, out=G)
+
+
+def _night_ir(block, out):
+    block.raw(13, out)
+    _normalize(out, 90, 313)
+    _invert(out)
+    return np.divide(out, 1.4, out=out)
+
+
+# ======================================================================
+# Kernels: each fills out (rows, x, 3) for one block, using scratch s
+# ======================================================================
+
+
+def _true_color(block, out, s, gamma=2.2, pseudoGreen=True, night_IR=True):
+
+    R, G, B, IR = s
+    for plane, c in ((R, 2), (G, 3), (B, 1)):
+        np.clip(block.channel(c, plane), 0, 1, out=plane)
+        _gamma(plane, gamma)
+
+    if pseudoGreen:
+        _pseudo_green(R, G, B, IR)
+
+    if night_IR:
+        _night_ir(block, IR)
+        for k, plane in enumerate((R, G, B)):
+            np.maximum(plane, IR, out=out[..., k])
+    else:
+        for k, plane in enumerate((R, G, B)):
+            out[..., k] = plane
+
+
+def _natural_color(block, out, s, gamma=0.8, pseudoGreen=True, night_IR=False):
+
+    R, G, B, IR = s
+    for plane, c in ((R, 2), (G, 3), (B, 1)):
+        np.clip(block.channel(c, plane), 0, 1, out=plane)
+
+    if pseudoGreen:
+        _pseudo_green(R, G, B, IR)
+
+    for plane in (R, G, B):
+        # Albedo to brightness, then the breakpoint stretch from rgb.py:
+        # min(normalize(v, 0, 10), normalize(v, 10, 255))
+        np.multiply(plane, 100, out=plane)
+        np.sqrt(plane, out=plane)
+        np.multiply(plane, 25.5, out=plane)
+        np.copyto(IR, plane)
+        _normalize(IR, 0, 10)
+        _normalize(plane, 10, 255)
+        np.minimum(plane, IR, out=plane)
+
+    if night_IR:
+        _night_ir(block, IR)
+        for plane in (R, G, B):
+            np.maximum(plane, IR, out=plane)
+
+    for k, plane in enumerate((R, G, B)):
+        _gamma(plane, gamma, out=out[..., k])
+
+
+def _day_cloud_phase(block, out, s):
+
+    R, G, B, _ = s
+    _invert(_normalize(block.channel(13, R), -53.5, 7.5), out=out[..., 0])
+    out[..., 1] = _normalize(block.channel(2, G), 0, 0.78)
+    out[..., 2] = _normalize(block.channel(5, B), 0.01, 0.59)
+
+
+def _day_convection(block, out, s):
+
+    R, G, B, tmp = s
+    out[..., 0] = _normalize(block.difference(8, 10, R, tmp), -35, 5)
+    out[..., 1] = _normalize(block.difference(7, 13, G, tmp), -5, 60)
+    out[..., 2] = _normalize(block.difference(5, 2, B, tmp), -0.75, 0.25)
+
+
+def _day_cloud_convection(block, out, s):
+
+    R, _, B, _ = s
+    # Red and green are both the gamma-corrected C02 reflectance
+    _gamma(_normalize(block.channel(2, R), 0, 1), 1.7)
+    out[..., 0] = R
+    out[..., 1] = R
+    _invert(_normalize(block.channel(13, B), -70.15, 49.85), out=out[..., 2])
+
+
+def _air_mass(block, out, s):
+
+    R, G, B, tmp = s
+    out[..., 0] = _normalize(block.difference(8, 10, R, tmp), -26.2, 0.6)
+    out[..., 1] = _normalize(block.difference(12, 13, G, tmp), -43.2, 6.7)
+    np.subtract(block.raw(8, B), 273.15, out=B)
+    out[..., 2] = _normalize(B, -29.25, -64.65)
+
+
+def _water_vapor(block, out, s):
+
+    R, G, B, _ = s
+    _invert(_normalize(block.channel(13, R), -70.86, 5.81), out=out[..., 0])
+    _invert(_normalize(block.channel(8, G), -58.49, -30.48), out=out[..., 1])
+    _invert(_normalize(block.channel(10, B), -28.03, -12.12), out=out[..., 2])
+
+
+def _differential_water_vapor(block, out, s):
+
+    R, G, B, tmp = s
+    _normalize(block.difference(10, 8, R, tmp), -3, 30)
+    np.subtract(block.raw(10, G), 273.15, out=G)
+    np.subtract(block.raw(8, B), 273.15, out=B)
+    _normalize(G, -60, 5)
+    _normalize(B, -64.65, -29.25)
+    for k, (plane, gamma) in enumerate(((R, 0.2587), (G, 0.4), (B, 0.4))):
+        _invert(_gamma(plane, gamma), out=out[..., k])
+
+
+# recipe name -> (kernel, description used by rgb.py)
+KERNELS = {
+    'TrueColor': (_true_color, 'True Color'),
+    'NaturalColor': (_natural_color, 'Natural Color'),
+    'DayCloudPhase': (_day_cloud_phase, 'Day Cloud Phase'),
+    'DayConvection': (_day_convection, 'Day Convection'),
+    'DayCloudConvection': (_day_cloud_convection, 'Day Cloud Convection'),
+    'AirMass': (_air_mass, 'Air Mass'),
+    'WaterVapor': (_water_vapor, 'Water Vapor'),
+    'DifferentialWaterVapor': (_differential_water_vapor, 'Differential Water Vapor'),
+}
+
+
+def composite(C, recipe, out=None, **options):
+
+    # Evaluate a recipe on granule C into a (y, x, 3) float32 image. A time
+    # stack with (t, y, x) channels gives (t, y, x, 3): every frame is just
+    # more rows to the kernels, so the whole stack goes through in one pass.
+    kernel, _ = KERNELS[recipe]
+    channels = RGB_CHANNELS[recipe]
+    if recipe in ('TrueColor', 'NaturalColor') and not options.get('night_IR', recipe == 'TrueColor'):
+        channels = channels[:3]
+
+    arrays = {c: np.asarray(C['CMI_C%02d' % c].data) for c in channels}
+    shape = next(iter(arrays.values())).shape
+    nx = shape[-1]
+    arrays = {c: (a.reshape(-1, nx), C['CMI_C%02d' % c].units) for c, a in arrays.items()}
+    if out is None:
+        out = np.empty(shape + (3,), dtype=np.float32)
+    elif not out.flags.c_contiguous:
+        raise ValueError('out must be C-contiguous')
+
+    ny = out.size // (nx * 3)
+    rows_out = out.reshape(ny, nx, 3)
+    step = max(1, BLOCK_BYTES // (nx * 4))
+
+    def run(r0):
+        rows = slice(r0, min(r0 + step, ny))
+        n = rows.stop - rows.start
+        scratch = [plane[:n] for plane in _scratch(step, nx)]
+        kernel(_Block(arrays, rows), rows_out[rows], scratch, **options)
+
+    list(_pool.map(run, range(0, ny, step)))
+    return out
+
+
+def fast_rgb(C, recipe, latlon=False, **options):
+
+    # Drop-in for the rgb.py recipe functions: same dataset, float32 data
+    _, description = KERNELS[recipe]
+    return rgb_as_dataset(C, composite(C, recipe, **options), description, latlon=latlon)
@@ -0,0 +1,83 @@
+import base64
+import io
+import os
+
+import numpy as np
+
+# Composites are sent to the browser as one compressed 8-bit image instead
+# of arrays of JSON floats. IMAGE_FORMAT is png (lossless) or webp;
+# WEBP_QUALITY=100 makes webp lossless too.
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'png')
+WEBP_QUALITY = int(os.environ.get('WEBP_QUALITY', 90))
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', 6))
+
+PALETTE_SIZE = 256
+
+
+def to_uint8(rgb):
+
+    # [0, 1] floats (NaN as black) to 0..255, rounding to nearest
+    out = np.multiply(rgb, 255, dtype=np.float32)
+    out += 0.5
+    np.clip(out, 0, 255, out=out)
+    np.nan_to_num(out, copy=False, nan=0)
+    return out.astype(np.uint8)
+
+
+def palette(colorscale, size=PALETTE_SIZE):
+
+    # size x 3 uint8 palette from a colormap: a matplotlib colormap is
+    # called directly, a Plotly colorscale (named, list of colors or
+    # [position, color] pairs) is sampled
+    positions = np.linspace(0, 1, size)
+    if callable(colorscale):
+        return to_uint8(np.asarray(colorscale(positions))[:, :3])
+
+    from plotly.colors import sample_colorscale, unlabel_rgb
+
+    sampled = sample_colorscale(colorscale, positions, colortype='rgb')
+    return np.array([unlabel_rgb(c) for c in sampled], dtype=np.float32).round().astype(np.uint8)
+
+
+def palette_indices(values, vmin=None, vmax=None, size=PALETTE_SIZE):
+
+    # Scalar field to palette indices over [vmin, vmax] (the data range by
+    # default, as px.imshow scales it); NaN maps to 0
+    values = np.asarray(values, dtype=np.float32)
+    vmin = np.nanmin(values) if vmin is None else vmin
+    vmax = np.nanmax(values) if vmax is None else vmax
+    scale = (size - 1) / max(float(vmax - vmin), np.finfo(np.float32).tiny)
+    out = np.subtract(values, vmin, dtype=np.float32)
+    out *= scale
+    out += 0.5
+    np.clip(out, 0, size - 1, out=out)
+    np.nan_to_num(out, copy=False, nan=0)
+    return out.astype(np.uint8)
+
+
+def encode_image(pixels, fmt=IMAGE_FORMAT, colors=None):
+
+    # pixels: (y, x, 3) uint8, or (y, x) palette indices with colors the
+    # palette. PNG keeps paletted images at one byte per pixel; WebP has no
+    # paletted mode, so the palette is applied first.
+    from PIL import Image
+
+    if colors is not None and fmt == 'png':
+        image = Image.fromarray(pixels, mode='P')
+        image.putpalette(np.ascontiguousarray(colors, dtype=np.uint8).tobytes())
+    else:
+        if colors is not None:
+            pixels = np.asarray(colors, dtype=np.uint8)[pixels]
+        image = Image.fromarray(np.ascontiguousarray(pixels), mode='RGB')
+
+    buffer = io.BytesIO()
+    if fmt == 'webp':
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY, lossless=WEBP_QUALITY >= 100)
+    else:
+        image.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def data_uri(data, fmt=IMAGE_FORMAT):
+
+    return f'data:image/{fmt};base64,' + base64.b64encode(data).decode('ascii')
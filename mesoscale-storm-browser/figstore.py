@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+
+def figure_key(*parts):
+
+    # Short, stable key that is cheap to ship through a dcc.Store
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+class FigureStore:
+
+    # Server-side LRU of serialized figures with a memory budget in bytes.
+    # Figures pushed out of memory are spilled to spill_dir (if given) and
+    # read back on the next hit instead of being rebuilt.
+
+    def __init__(self, max_bytes, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.nbytes = 0
+        self._figs = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._figs:
+                return True
+        return bool(self.spill_dir) and os.path.exists(self._spill_path(key))
+
+    def __len__(self):
+        return len(self._figs)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f'{key}.json')
+
+    def _spill(self, key, data):
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            tmp = f'{path}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    def _insert(self, key, data):
+        with self._lock:
+            if key in self._figs:
+                self._figs.move_to_end(key)
+                return
+            if len(data) > self.max_bytes:
+                if self.spill_dir:
+                    self._spill(key, data)
+                return
+            self._figs[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                old_key, old_data = self._figs.popitem(last=False)
+                self.nbytes -= len(old_data)
+                if self.spill_dir:
+                    self._spill(old_key, old_data)
+
+    def get(self, key):
+
+        with self._lock:
+            data = self._figs.get(key)
+            if data is not None:
+                self._figs.move_to_end(key)
+                return json.loads(data)
+
+        if self.spill_dir and os.path.exists(self._spill_path(key)):
+            with open(self._spill_path(key)) as f:
+                data = f.read()
+            self._insert(key, data)
+            return json.loads(data)
+
+        return None
+
+    def put(self, key, fig):
+
+        # Store the JSON form: it is what goes over the wire, so the budget
+        # is accounted in real payload bytes and spilling is a plain write
+        data = pio.to_json(fig, validate=False)
+        self._insert(key, data)
+        return json.loads(data)
+
+    def clear(self):
+        with self._lock:
+            self._figs.clear()
+            self.nbytes = 0
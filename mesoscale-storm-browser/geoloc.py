@@ -0,0 +1,175 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Set GEOLOC_CACHE_DIR to keep computed grids across restarts
+GEOLOC_CACHE_DIR = os.environ.get('GEOLOC_CACHE_DIR')
+GEOLOC_CACHE_ENTRIES = int(os.environ.get('GEOLOC_CACHE_ENTRIES', 32))
+
+# Width and height in pixels of the storm-centred crop view
+CROP_PIXELS = int(os.environ.get('CROP_PIXELS', 250))
+
+
+def projection_params(G):
+
+    p = G.goes_imager_projection.attrs
+    return (float(p['semi_major_axis']),
+            float(p['semi_minor_axis']),
+            float(p['longitude_of_projection_origin']),
+            float(p['perspective_point_height']))
+
+
+def geostationary_crs(G):
+
+    # Cartopy CRS of granule G's fixed grid, for the imshow helpers in
+    # rgb.py; None without cartopy, which compositing does not need
+    try:
+        import cartopy.crs as ccrs
+    except ImportError:
+        return None
+    r_eq, r_pol, lon_0, h_sat = projection_params(G)
+    globe = ccrs.Globe(ellipse=None, semimajor_axis=r_eq, semiminor_axis=r_pol)
+    return ccrs.Geostationary(central_longitude=lon_0, satellite_height=h_sat, globe=globe,
+                              sweep_axis=G.goes_imager_projection.attrs.get('sweep_angle_axis', 'x'))
+
+
+def fixed_grid_latlon(x, y, r_eq, r_pol, lon_0, h_sat):
+
+    # GOES-R fixed grid scan angles (rad) to geodetic lat/lon (degrees), as
+    # in the GOES-R PUG and the notebooks' calc_latlon. The trig terms are
+    # separable, so they are evaluated on the 1-D x and y vectors only;
+    # the 2-D part is a handful of broadcast multiply/adds. The quadratic is
+    # solved in float64 (b**2 - 4ac cancels badly in float32) and the grids
+    # are returned as float32. Off-earth pixels are NaN.
+    x = np.asarray(x, dtype=np.float64)[np.newaxis, :]
+    y = np.asarray(y, dtype=np.float64)[:, np.newaxis]
+    H = r_eq + h_sat
+    e = r_eq**2 / r_pol**2
+
+    sin_x, cos_x = np.sin(x), np.cos(x)
+    sin_y, cos_y = np.sin(y), np.cos(y)
+
+    a = sin_x**2 + cos_x**2 * (cos_y**2 + e * sin_y**2)
+    b = -2 * H * cos_x * cos_y
+    c = H**2 - r_eq**2
+
+    with np.errstate(invalid='ignore'):
+        r_s = (-b - np.sqrt(b**2 - 4 * a * c)) / (2 * a)
+
+    s_x = r_s * cos_x * cos_y
+    s_y = -r_s * sin_x
+    s_z = r_s * cos_x * sin_y
+
+    lat = np.degrees(np.arctan(e * s_z / np.hypot(H - s_x, s_y)))
+    lon = lon_0 - np.degrees(np.arctan(s_y / (H - s_x)))
+    return lat.astype(np.float32), lon.astype(np.float32)
+
+
+def latlon_to_fixed_grid(lat, lon, r_eq, r_pol, lon_0, h_sat):
+
+    # Geodetic lat/lon (degrees) to GOES-R fixed grid scan angles x, y
+    # (rad), the inverse of fixed_grid_latlon (GOES-R PUG 4.2.8.1)
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    H = r_eq + h_sat
+    e2 = (r_eq**2 - r_pol**2) / r_eq**2
+
+    phi_c = np.arctan(r_pol**2 / r_eq**2 * np.tan(lat))
+    r_c = r_pol / np.sqrt(1 - e2 * np.cos(phi_c)**2)
+    dlon = lon - np.radians(lon_0)
+
+    s_x = H - r_c * np.cos(phi_c) * np.cos(dlon)
+    s_y = -r_c * np.cos(phi_c) * np.sin(dlon)
+    s_z = r_c * np.sin(phi_c)
+
+    x = np.arcsin(-s_y / np.sqrt(s_x**2 + s_y**2 + s_z**2))
+    y = np.arctan(s_z / s_x)
+    return x, y
+
+
+def crop_window(G, lat, lon, size):
+
+    # {'y': (start, stop), 'x': (start, stop)} index bounds of the
+    # size x size pixel window of granule G centred on lat/lon, shifted
+    # inwards where it would run off the sector; None when the point is not
+    # on the sector
+    x0, y0 = latlon_to_fixed_grid(lat, lon, *projection_params(G))
+
+    def window(values, centre):
+        i = int(np.abs(values - centre).argmin())
+        if abs(values[i] - centre) > abs(values[1] - values[0]):
+            return None
+        width = min(size, len(values))
+        start = min(max(i - width // 2, 0), len(values) - width)
+        return start, start + width
+
+    ys, xs = window(G.y.values, y0), window(G.x.values, x0)
+    if ys is None or xs is None:
+        return None
+    return {'y': ys, 'x': xs}
+
+
+class GeolocationCache:
+
+    # lat/lon grids keyed by projection parameters and the x/y scan angles.
+    # Mesoscale sectors keep the same grid for hours at a time, so most
+    # granules of a storm hit the cache.
+
+    def __init__(self, max_entries=GEOLOC_CACHE_ENTRIES, cache_dir=GEOLOC_CACHE_DIR):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._grids = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(x, y, params):
+        h = hashlib.sha1(repr(params).encode())
+        h.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def _remember(self, key, grid):
+        with self._lock:
+            self._grids[key] = grid
+            self._grids.move_to_end(key)
+            while len(self._grids) > self.max_entries:
+                self._grids.popitem(last=False)
+
+    def latlon(self, x, y, params):
+
+        key = self.key(x, y, params)
+        with self._lock:
+            grid = self._grids.get(key)
+            if grid is not None:
+                self._grids.move_to_end(key)
+                return grid
+
+        if self.cache_dir and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as f:
+                grid = f['lat'], f['lon']
+        else:
+            grid = fixed_grid_latlon(x, y, *params)
+            if self.cache_dir:
+                tmp = self._path(key) + '.tmp.npz'
+                np.savez(tmp, lat=grid[0], lon=grid[1])
+                os.replace(tmp, self._path(key))
+
+        self._remember(key, grid)
+        return grid
+
+
+geolocation = GeolocationCache()
+
+
+def latlon_grid(G):
+
+    # (lat, lon) float32 grids for granule G
+    return geolocation.latlon(G.x.values, G.y.values, projection_params(G))
@@ -0,0 +1,157 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from manifest import load_manifest
+from metrics import CountingFile, count_bytes
+from prefetch import PREFETCH_WINDOW
+from refindex import load_index, open_storm, granule_view
+from storage import make_store
+from stormzarr import load_zarr_index, open_storm_zarr
+
+# Built offline by manifest.py; empty if it has not been generated yet
+manifest = load_manifest()
+
+# Storms indexed by refindex.py are read chunk by chunk with ranged GETs
+ref_index = load_index()
+
+# Storms converted by stormzarr.py are read one time step of chunks at a time
+zarr_index = load_zarr_index()
+
+# Whole granules downloaded by fetch_granules, kept until open_granule has
+# decoded them (an MCMIPM granule is about 4 MB)
+FETCH_BUFFERS = int(os.environ.get('FETCH_BUFFERS', 16))
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 8))
+
+# Open granules kept: every step of the prefetch window on either side of
+# the current one, for both sectors side by side, each opened decoded (the
+# surface's C13) and raw (LUT composites)
+OPEN_GRANULES = int(os.environ.get('OPEN_GRANULES', (2 * PREFETCH_WINDOW + 1) * 2 * 2))
+
+_buffers = OrderedDict()
+_buffers_lock = threading.Lock()
+_resolve_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='resolve')
+
+
+@lru_cache(maxsize=None)
+def get_store():
+
+    # Chosen by GRANULE_STORE (see storage.py) and created on first use
+    return make_store()
+
+
+def resolve_granule(prefix):
+
+    # Catalog entries are object key prefixes; find the actual .nc object,
+    # from the manifest when we have it and with a LIST when we don't
+    entry = manifest.get(prefix)
+    if entry and entry['key']:
+        return entry['key']
+    return get_store().glob(f'{prefix}*.nc')[0]
+
+
+def resolve_granules(prefixes):
+
+    # Unresolved prefixes each cost a LIST, so they are looked up together;
+    # empty catalog cells resolve to None
+    return list(_resolve_pool.map(lambda p: resolve_granule(p) if p else None, prefixes))
+
+
+def fetch_granules(keys):
+
+    # Download every granule a view needs in one concurrent batch over the
+    # store's pooled connections, so the wait is the slowest fetch rather
+    # than the sum. Indexed storms and granules already buffered (e.g. by
+    # the prefetcher) are skipped, and the buffered ones count as used.
+    with _buffers_lock:
+        for k in keys:
+            if k in _buffers:
+                _buffers.move_to_end(k)
+        todo = [k for k in dict.fromkeys(keys)
+                if k and k not in _buffers and k not in ref_index and k not in zarr_index]
+    if not todo:
+        return
+    store = get_store()
+    fetched = store.cat(todo)
+    with _buffers_lock:
+        for key, data in fetched.items():
+            count_bytes(store.name, len(data))
+            _buffers[key] = data
+            _buffers.move_to_end(key)
+        while len(_buffers) > FETCH_BUFFERS:
+            _buffers.popitem(last=False)
+
+
+@lru_cache(maxsize=8)
+def open_refs(refs_path, raw=False):
+
+    return open_storm(refs_path, mask_and_scale=not raw)
+
+
+def open_granule(path, raw=False):
+
+    # Lazily opened granules are shared between the graph and rgb callbacks
+    # and the prefetcher, so this holds a prefetch window on either side
+    # (see OPEN_GRANULES).
+    # Variables stay on S3 until load_granule asks for them, and once loaded
+    # they are kept with the cached dataset. raw=True leaves the packed
+    # integer counts as stored (no mask-and-scale), for lut.py. Granules
+    # brought in by fetch_granules are decoded from memory instead, and
+    # whether they were is part of the cache key: a granule first opened
+    # for ranged reads (a crop) is reopened from its buffer once fetched.
+    with _buffers_lock:
+        buffered = path in _buffers and path not in zarr_index and path not in ref_index
+    return _open_granule(path, raw, buffered)
+
+
+@lru_cache(maxsize=OPEN_GRANULES)
+def _open_granule(path, raw, buffered):
+
+    import xarray as xr
+
+    stored = zarr_index.get(path)
+    if stored:
+        return granule_view(open_storm_zarr(stored['store'], raw), stored['position'])
+    ref = ref_index.get(path)
+    if ref:
+        return granule_view(open_refs(ref['refs'], raw), ref['position'])
+    if buffered:
+        with _buffers_lock:
+            data = _buffers.get(path)
+        if data is not None:
+            return xr.open_dataset(io.BytesIO(data), engine='h5netcdf', mask_and_scale=not raw)
+    store = get_store()
+    return xr.open_dataset(CountingFile(store.open(path, ranged=True), store.name), engine='h5netcdf',
+                           mask_and_scale=not raw)
+
+
+def load_granule(path, variables=None, raw=False, window=None):
+
+    # Read and decode only the requested variables (all of them if None).
+    # window: {'y': (start, stop), 'x': (start, stop)} reads just that
+    # pixel window, which for chunked stores means just the chunks under it.
+    ds = open_granule(path, raw)
+    if variables is not None:
+        ds = ds[[v for v in variables if v in ds]]
+    if window:
+        ds = ds.isel({dim: slice(*bounds) for dim, bounds in window.items()})
+    return ds.load()
+
+
+def close_granules():
+
+    # Drop every open granule, keeping the fetched buffers
+    _open_granule.cache_clear()
+
+
+def clear_granules():
+
+    # Drop every open granule and fetched buffer (batch jobs, between frames)
+    close_granules()
+    open_refs.cache_clear()
+    open_storm_zarr.cache_clear()
+    with _buffers_lock:
+        _buffers.clear()
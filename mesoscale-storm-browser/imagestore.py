@@ -0,0 +1,97 @@
+import csv
+import hashlib
+import os
+import threading
+
+# Where prerender.py writes and the app looks for pre-rendered composites
+PRERENDER_DIR = os.environ.get('PRERENDER_DIR', 'data/prerendered')
+
+INDEX_FIELDS = ['key', 'mode', 'digest', 'format']
+
+
+class ImageStore:
+
+    # Content-addressed store of encoded composites written by prerender.py:
+    # objects/<ab>/<sha256>.<format>, plus index.csv mapping each
+    # (granule key, RGB mode) to its object. Identical images (e.g. all-night
+    # frames of a visible product) are kept once.
+
+    def __init__(self, root):
+        self.root = root
+        self._index = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+
+        # Re-read the index if it changed on disk, so frames a prerender.py
+        # run adds while the app is up are served without a restart
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        index = {}
+        with open(self.index_path, newline='') as f:
+            for row in csv.DictReader(f):
+                # A row still being appended has its last fields missing
+                if row['format']:
+                    index[row['key'], row['mode']] = (row['digest'], row['format'])
+        with self._lock:
+            self._index, self._mtime = index, mtime
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, 'index.csv')
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, item):
+        return item in self._index
+
+    def object_path(self, digest, fmt):
+        return os.path.join(self.root, 'objects', digest[:2], f'{digest}.{fmt}')
+
+    def get(self, key, mode):
+
+        # (encoded bytes, format), or None if the frame was not pre-rendered
+        self.refresh()
+        entry = self._index.get((key, mode))
+        if entry is None:
+            return None
+        digest, fmt = entry
+        try:
+            with open(self.object_path(digest, fmt), 'rb') as f:
+                return f.read(), fmt
+        except FileNotFoundError:
+            return None
+
+    def put(self, data, fmt):
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest, fmt)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def record(self, rows):
+
+        # Append index rows; only written once their objects are in place,
+        # so a frame in the index is always complete
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            new_file = not os.path.exists(self.index_path)
+            with open(self.index_path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+            for row in rows:
+                self._index[row['key'], row['mode']] = (row['digest'], row['format'])
@@ -0,0 +1,150 @@
+"""Lookup-table compositing on packed CMI counts.
+
+CMI bands are stored as 12-bit counts in 16-bit integers with a per-band
+scale/offset. When an output plane depends on a single channel, its whole
+normalize -> gamma -> invert chain is a function of the count alone, so it
+is evaluated once for every possible count (with the float64 functions from
+rgb.py) and the plane is filled by indexing that table with the raw counts.
+
+Fallbacks:
+- planes built from more than one channel (the channel differences in
+  DayConvection, AirMass and DifferentialWaterVapor) are decoded to float32 and the
+  chain is evaluated directly;
+- recipes that mix channels inside the chain (TrueColor and NaturalColor
+  with pseudo green or night IR) are decoded to float32 and run through the
+  composite.py engine.
+
+Granules must be opened with mask_and_scale=False.
+"""
+from functools import lru_cache
+
+import numpy as np
+import xarray as xr
+
+from composite import composite
+from rgb import RGB_CHANNELS, normalize, gamma_correction
+
+K = 273.15
+
+# recipe -> one (channels, chain) per output plane. chain receives physical
+# values (reflectance, or brightness temperature in Kelvin) of its channels.
+LUT_RECIPES = {
+    "DayCloudPhase": [
+        ((13,), lambda C13: 1 - normalize(C13 - K, -53.5, 7.5)),
+        ((2,), lambda C02: normalize(C02, 0, 0.78)),
+        ((5,), lambda C05: normalize(C05, 0.01, 0.59)),
+    ],
+    "DayCloudConvection": [
+        ((2,), lambda C02: gamma_correction(normalize(C02, 0, 1), 1.7)),
+        ((2,), lambda C02: gamma_correction(normalize(C02, 0, 1), 1.7)),
+        ((13,), lambda C13: 1 - normalize(C13 - K, -70.15, 49.85)),
+    ],
+    "WaterVapor": [
+        ((13,), lambda C13: 1 - normalize(C13 - K, -70.86, 5.81)),
+        ((8,), lambda C08: 1 - normalize(C08 - K, -58.49, -30.48)),
+        ((10,), lambda C10: 1 - normalize(C10 - K, -28.03, -12.12)),
+    ],
+    "DayConvection": [
+        ((8, 10), lambda C08, C10: normalize(C08 - C10, -35, 5)),
+        ((7, 13), lambda C07, C13: normalize(C07 - C13, -5, 60)),
+        ((5, 2), lambda C05, C02: normalize(C05 - C02, -0.75, 0.25)),
+    ],
+    "AirMass": [
+        ((8, 10), lambda C08, C10: normalize(C08 - C10, -26.2, 0.6)),
+        ((12, 13), lambda C12, C13: normalize(C12 - C13, -43.2, 6.7)),
+        ((8,), lambda C08: normalize(C08 - K, -29.25, -64.65)),
+    ],
+    "DifferentialWaterVapor": [
+        ((10, 8), lambda C10, C08: 1 - gamma_correction(normalize(C10 - C08, -3, 30), 0.2587)),
+        ((10,), lambda C10: 1 - gamma_correction(normalize(C10 - K, -60, 5), 0.4)),
+        ((8,), lambda C08: 1 - gamma_correction(normalize(C08 - K, -64.65, -29.25), 0.4)),
+    ],
+}
+
+
+def _packing(var):
+
+    # (scale, offset, fill as a 16-bit pattern, signed). int16 counts are
+    # signed unless flagged _Unsigned, as xarray reads them.
+    attrs = var.attrs
+    fill = attrs.get("_FillValue")
+    unsigned = str(attrs.get("_Unsigned", "false")).lower() == "true"
+    return (float(attrs.get("scale_factor", 1.0)),
+            float(attrs.get("add_offset", 0.0)),
+            None if fill is None else int(fill) & 0xFFFF,
+            var.dtype.kind == "i" and not unsigned)
+
+
+def counts(var):
+
+    # Raw counts as non-negative indices into a 65536-entry table: their
+    # 16-bit patterns, signed or not (plane_table is laid out to match)
+    data = np.asarray(var.data)
+    if data.dtype == np.int16:
+        data = data.view(np.uint16)
+    return data
+
+
+def decode(var, dtype=np.float32):
+
+    # Same as xarray's mask-and-scale, at the requested precision
+    scale, offset, fill, signed = _packing(var)
+    c = counts(var)
+    out = (c.view(np.int16) if signed else c).astype(dtype)
+    out *= dtype(scale)
+    out += dtype(offset)
+    if fill is not None:
+        out[c == fill] = np.nan
+    return out
+
+
+@lru_cache(maxsize=64)
+def plane_table(recipe, plane, packing, dtype=np.float32):
+
+    # Chain output for every possible count of a single-channel plane,
+    # indexed by 16-bit pattern: entries 32768 and up are the negative
+    # counts when the counts are signed
+    scale, offset, fill, signed = packing
+    (_, chain) = LUT_RECIPES[recipe][plane]
+    bits = np.arange(2**16, dtype=np.uint16)
+    table = (bits.view(np.int16) if signed else bits).astype(np.float64) * scale + offset
+    if fill is not None:
+        table[fill] = np.nan
+    table = chain(table)
+    if dtype == np.uint8:
+        return np.round(np.nan_to_num(table, nan=0.0) * 255).astype(np.uint8)
+    return table.astype(dtype)
+
+
+def lut_composite(R, recipe, dtype=np.float32, out=None, **options):
+
+    # Evaluate a recipe on raw granule R into a (y, x, 3) image, or a
+    # (t, y, x, 3) stack for (t, y, x) channels. uint8 output is the [0, 1]
+    # image scaled to 0-255.
+    names = {c: "CMI_C%02d" % c for c in RGB_CHANNELS[recipe]}
+    first = R[names[RGB_CHANNELS[recipe][0]]]
+    if out is None:
+        out = np.empty(first.shape + (3,), dtype=dtype)
+
+    if recipe not in LUT_RECIPES:
+        decoded = xr.Dataset({name: (R[name].dims, decode(R[name]), {"units": R[name].attrs.get("units")})
+                              for name in names.values()})
+        image = composite(decoded, recipe, **options)
+        if dtype == np.uint8:
+            np.multiply(np.nan_to_num(image, nan=0.0), 255, out=image)
+            np.rint(image, out=image)
+        out[...] = image
+        return out
+
+    for k, (channels, chain) in enumerate(LUT_RECIPES[recipe]):
+        if len(channels) == 1:
+            var = R[names[channels[0]]]
+            table = plane_table(recipe, k, _packing(var), dtype)
+            np.take(table, counts(var), out=out[..., k], mode="clip")
+        else:
+            plane = chain(*(decode(R[names[c]]) for c in channels))
+            if dtype == np.uint8:
+                plane = np.rint(np.nan_to_num(plane, nan=0.0) * 255)
+            out[..., k] = plane
+
+    return out
@@ -0,0 +1,101 @@
+"""Resolve catalog key prefixes to exact S3 objects.
+
+The storm catalog stores granule locations as key prefixes (the start-time
+part of the file name), so the app used to run an S3 LIST for every request.
+This script lists every prefix once, in parallel, and writes the object key,
+size and ETag to a manifest the app loads at startup.
+
+    python manifest.py data/storm_data.csv -o data/granule_manifest.csv
+
+Rows are appended as they resolve, so an interrupted run picks up where it
+left off when started again with the same output file.
+"""
+import argparse
+import csv
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from catalog import CATALOG_CSV
+
+PREFIX_COLUMNS = ['m1_combined', 'm2_combined', 'm1_c13', 'm2_c13']
+MANIFEST_FIELDS = ['prefix', 'key', 'size', 'etag']
+MANIFEST_PATH = 'data/granule_manifest.csv'
+
+
+def load_manifest(path=MANIFEST_PATH):
+
+    # prefix -> row dict; prefixes that matched no object have an empty key
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        return {row['prefix']: row for row in csv.DictReader(f)}
+
+
+def catalog_prefixes(catalog_path, columns=PREFIX_COLUMNS, storms=None):
+
+    # storms: only rows whose storm_name is in it (all rows if None)
+    prefixes = []
+    with open(catalog_path, newline='') as f:
+        for row in csv.DictReader(f):
+            if storms is not None and row['storm_name'] not in storms:
+                continue
+            for c in columns:
+                if row.get(c):
+                    prefixes.append(row[c])
+    return list(dict.fromkeys(prefixes))
+
+
+def resolve_prefix(fs, prefix):
+
+    found = fs.glob(f'{prefix}*.nc', detail=True)
+    if not found:
+        return dict(prefix=prefix, key='', size='', etag='')
+    key, info = sorted(found.items())[0]
+    return dict(prefix=prefix,
+                key=key,
+                size=info.get('size', ''),
+                etag=str(info.get('ETag', '')).strip('"'))
+
+
+def resolve_catalog(catalog_path, out_path=MANIFEST_PATH, workers=32, fs=None):
+
+    if fs is None:
+        import s3fs
+        fs = s3fs.S3FileSystem(anon=True)
+
+    done = load_manifest(out_path)
+    todo = [p for p in catalog_prefixes(catalog_path) if p not in done]
+    print(f'{len(done)} prefixes already resolved, {len(todo)} to go')
+
+    lock = threading.Lock()
+    new_file = not os.path.exists(out_path)
+    with open(out_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        if new_file:
+            writer.writeheader()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(resolve_prefix, fs, p): p for p in todo}
+            for i, future in enumerate(as_completed(futures), 1):
+                try:
+                    row = future.result()
+                except Exception as e:
+                    # Leave it out of the checkpoint so the next run retries
+                    print(f'failed: {futures[future]}: {e}')
+                    continue
+                with lock:
+                    writer.writerow(row)
+                    f.flush()
+                if i % 500 == 0:
+                    print(f'{i}/{len(todo)}')
+
+    return load_manifest(out_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('catalog', nargs='?', default=CATALOG_CSV)
+    parser.add_argument('-o', '--output', default=MANIFEST_PATH)
+    parser.add_argument('-j', '--workers', type=int, default=32)
+    args = parser.parse_args()
+    resolve_catalog(args.catalog, args.output, workers=args.workers)
@@ -0,0 +1,198 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+# TRACE_REQUESTS=1 prints one line per callback with the time of each stage
+TRACE_REQUESTS = os.environ.get('TRACE_REQUESTS', '0') == '1'
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, math.inf)
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+
+    # Per-stage latency histograms, byte counters and error counters,
+    # rendered in the Prometheus text exposition format
+
+    def __init__(self, prefix='storm_browser'):
+        self.prefix = prefix
+        self._stages = {}
+        self._bytes = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = Histogram()
+            hist.observe(seconds)
+
+    def count_bytes(self, source, n):
+        with self._lock:
+            self._bytes[source] = self._bytes.get(source, 0) + n
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(self._bytes.values())
+
+    def count_error(self, stage):
+        with self._lock:
+            self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    def render(self):
+
+        name = f'{self.prefix}_stage_seconds'
+        lines = [f'# HELP {name} Callback stage latency.',
+                 f'# TYPE {name} histogram']
+        with self._lock:
+            for stage, hist in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.counts):
+                    cumulative += n
+                    le = '+Inf' if bound == math.inf else repr(float(bound))
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {hist.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {hist.count}')
+
+            name = f'{self.prefix}_read_bytes_total'
+            lines += [f'# HELP {name} Bytes read from granule storage.',
+                      f'# TYPE {name} counter']
+            for source, n in sorted(self._bytes.items()):
+                lines.append(f'{name}{{source="{source}"}} {n}')
+
+            name = f'{self.prefix}_errors_total'
+            lines += [f'# HELP {name} Failed background work.',
+                      f'# TYPE {name} counter']
+            for stage, n in sorted(self._errors.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {n}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextmanager
+def trace(name):
+
+    # One callback run; spans inside it are collected for the trace line
+    spans = []
+    token = _trace.set(spans)
+    start = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        seconds = time.perf_counter() - start
+        _trace.reset(token)
+        registry.observe(name, seconds)
+        if TRACE_REQUESTS:
+            stages = ' '.join(f'{stage}={s * 1000:.1f}ms' for stage, s in spans)
+            print(f'Trace: {name} {seconds * 1000:.1f}ms {stages}')
+
+
+@contextmanager
+def span(stage):
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe(stage, seconds)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append((stage, seconds))
+
+
+def count_bytes(source, n):
+    registry.count_bytes(source, n)
+
+
+def count_error(stage, error):
+
+    registry.count_error(stage)
+    if TRACE_REQUESTS:
+        print(f'Trace: {stage} failed: {error}')
+
+
+class CountingFile:
+
+    # File-like wrapper that counts bytes read through it
+
+    def __init__(self, f, source):
+        self._f = f
+        self._source = source
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        count_bytes(self._source, len(data))
+        return data
+
+    def readinto(self, b):
+        n = self._f.readinto(b)
+        count_bytes(self._source, n or 0)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+class CountingMapper(MutableMapping):
+
+    # Key/value store wrapper (e.g. a Zarr chunk mapper) counting value bytes
+
+    def __init__(self, mapper, source):
+        self._mapper = mapper
+        self._source = source
+
+    def __getitem__(self, key):
+        value = self._mapper[key]
+        count_bytes(self._source, len(value))
+        return value
+
+    def __setitem__(self, key, value):
+        self._mapper[key] = value
+
+    def __delitem__(self, key):
+        del self._mapper[key]
+
+    def __contains__(self, key):
+        return key in self._mapper
+
+    def __iter__(self):
+        return iter(self._mapper)
+
+    def __len__(self):
+        return len(self._mapper)
+
+    def __getattr__(self, name):
+        return getattr(self._mapper, name)
@@ -0,0 +1,133 @@
+"""Copy storms' granules to a local directory.
+
+Every granule the catalog lists for the given storms is copied from S3 (or
+the public HTTPS endpoint) into a directory laid out like the bucket, in
+parallel. Each copy is checked against the object's size and, for objects
+uploaded in one part, the MD5 in its ETag before it is moved into place.
+
+    python mirror.py "Hurricane Ida" "Hurricane Elsa" -o data/granules -j 16
+    GRANULE_STORE=local python app.py
+
+Granules already mirrored with the right size are skipped, so an
+interrupted run can simply be started again; --verify also re-checksums
+them.
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from catalog import CATALOG_CSV
+from manifest import PREFIX_COLUMNS, catalog_prefixes, load_manifest, resolve_prefix
+from storage import GRANULE_DIR, LocalStorage, make_store
+
+CHUNK_BYTES = 8 * 2**20
+
+# Single-part uploads have the object's MD5 as their ETag; multipart ETags
+# end in -<parts> and can only be checked by size
+MD5_ETAG = re.compile(r'^[0-9a-f]{32}$')
+
+
+def md5sum(path):
+
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def verified(path, size, etag):
+
+    if not os.path.exists(path):
+        return False
+    if size != '' and os.path.getsize(path) != int(size):
+        return False
+    return not (etag and MD5_ETAG.match(etag)) or md5sum(path) == etag
+
+
+def mirror_granule(remote, local, entry, verify=False):
+
+    key, size, etag = entry['key'], entry['size'], str(entry['etag']).strip('"')
+    path = local.path(key)
+    if os.path.exists(path) and (verified(path, size, etag) if verify else
+                                 size == '' or os.path.getsize(path) == int(size)):
+        return 'skipped'
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = path + '.part'
+    h = hashlib.md5()
+    with remote.open(key) as src, open(part, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_BYTES), b''):
+            h.update(chunk)
+            dst.write(chunk)
+
+    if size != '' and os.path.getsize(part) != int(size):
+        os.remove(part)
+        raise IOError(f'{key}: expected {size} bytes, got {os.path.getsize(part)}')
+    if etag and MD5_ETAG.match(etag) and h.hexdigest() != etag:
+        os.remove(part)
+        raise IOError(f'{key}: MD5 {h.hexdigest()} does not match ETag {etag}')
+    os.replace(part, path)
+    return 'copied'
+
+
+def mirror_storms(storms, catalog_path=CATALOG_CSV, out_dir=GRANULE_DIR,
+                  source='s3', columns=PREFIX_COLUMNS, workers=16, verify=False):
+
+    remote = make_store(source)
+    local = LocalStorage(out_dir)
+    manifest = load_manifest()
+
+    def resolve(prefix):
+        # The manifest has key, size and ETag for resolved prefixes; the
+        # rest cost a LIST
+        entry = manifest.get(prefix)
+        if entry and entry['key']:
+            return entry
+        return resolve_prefix(remote, prefix)
+
+    prefixes = catalog_prefixes(catalog_path, columns, storms=set(storms))
+    if not prefixes:
+        raise ValueError(f'No catalog rows for {", ".join(storms)}')
+    print(f'{len(prefixes)} granules to mirror from {source}')
+
+    counts = {'copied': 0, 'skipped': 0, 'missing': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def mirror(prefix):
+            entry = resolve(prefix)
+            if not entry['key']:
+                return 'missing'
+            return mirror_granule(remote, local, entry, verify)
+
+        futures = {pool.submit(mirror, p): p for p in prefixes}
+        for i, future in enumerate(as_completed(futures), 1):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                print(f'failed: {futures[future]}: {e}')
+                counts['failed'] += 1
+            if i % 100 == 0:
+                print(f'{i}/{len(prefixes)}')
+
+    print(', '.join(f'{n} {status}' for status, n in counts.items()))
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('storms', nargs='+', help='storm names as in the catalog')
+    parser.add_argument('--catalog', default=CATALOG_CSV)
+    parser.add_argument('-o', '--output', default=GRANULE_DIR)
+    parser.add_argument('--source', choices=['s3', 'http'], default='s3')
+    parser.add_argument('--columns', default=','.join(PREFIX_COLUMNS),
+                        help='catalog columns whose granules are copied')
+    parser.add_argument('-j', '--workers', type=int, default=16)
+    parser.add_argument('--verify', action='store_true', help='re-checksum granules already mirrored')
+    args = parser.parse_args()
+    counts = mirror_storms(args.storms, args.catalog, args.output, args.source,
+                           args.columns.split(','), args.workers, args.verify)
+    sys.exit(1 if counts['failed'] else 0)
@@ -0,0 +1,84 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import count_error, span, trace
+
+# Granules fetched on each side of the current time step, and the number of
+# background fetches allowed to run at once
+PREFETCH_WINDOW = int(os.environ.get('PREFETCH_WINDOW', 2))
+PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 2))
+
+
+class Prefetcher:
+
+    # Warms the granule cache around the time step being viewed, per
+    # session. A session's new schedule() drops its own queued work from
+    # the previous one (other sessions' is left alone), and in-flight
+    # fetches for a storm that session has left are skipped.
+
+    def __init__(self, window=PREFETCH_WINDOW, workers=PREFETCH_WORKERS, max_sessions=10000):
+        self.window = window
+        self.max_sessions = max_sessions
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        # session -> (storm, pending futures)
+        self._sessions = OrderedDict()
+
+    def cancel(self, session=None):
+        with self._lock:
+            self._cancel(session)
+
+    def _cancel(self, session):
+        _, pending = self._sessions.pop(session, (None, []))
+        for future in pending:
+            future.cancel()
+
+    def _storm(self, session):
+        with self._lock:
+            return self._sessions.get(session, (None, []))[0]
+
+    def neighbours(self, index, count):
+
+        # Nearest first, the next step ahead of the previous one
+        order = []
+        for step in range(1, self.window + 1):
+            for i in (index + step, index - step):
+                if 0 <= i < count:
+                    order.append(i)
+        return order
+
+    def schedule(self, storm_name, sectors, index, reads=((None, False),), session=None):
+
+        # sectors: one list of granule prefixes per sector on screen; each
+        # neighbouring step is warmed for all of them before the next one.
+        # reads: (variables, raw) pairs, loaded exactly as the callbacks
+        # will ask for them, since raw and decoded opens are cached apart.
+        with self._lock:
+            self._cancel(session)
+            self._sessions[session] = (storm_name, [
+                self._pool.submit(self._fetch, session, storm_name, prefixes[i], reads)
+                for i in self.neighbours(index, len(sectors[0]))
+                for prefixes in sectors if prefixes[i]])
+            while len(self._sessions) > self.max_sessions:
+                self._cancel(next(iter(self._sessions)))
+
+    def _fetch(self, session, storm_name, prefix, reads):
+
+        from granules import resolve_granule, fetch_granules, load_granule
+
+        if storm_name != self._storm(session):
+            return
+        # Downloaded through fetch_granules, so the buffer it leaves is what
+        # update_graphs finds when the user steps onto this granule
+        with trace('prefetch'):
+            try:
+                with span('prefetch fetch'):
+                    key = resolve_granule(prefix)
+                    fetch_granules([key])
+                with span('prefetch read'):
+                    for variables, raw in reads:
+                        load_granule(key, variables, raw=raw)
+            except Exception as e:
+                count_error('prefetch', f'{prefix}: {e}')
@@ -0,0 +1,112 @@
+"""Pre-render every RGB mode of every catalogued granule.
+
+Each granule of the catalog's mesoscale sectors is fetched once and all
+eight RGB modes are built from it in a pool of worker processes, encoded as
+8-bit PNG (or WebP) exactly as the app sends them, and written to a
+content-addressed image store. With the store in place (PRERENDER_DIR,
+data/prerendered by default) the app serves those frames by lookup instead
+of compositing them.
+
+    python prerender.py data/storm_data.csv -o data/prerendered -j 8
+    python prerender.py --storms "Hurricane Ida" "Hurricane Elsa"
+
+The store's index is appended as granules finish, and granules whose modes
+are all indexed are skipped, so an interrupted run resumes where it left
+off when started again with the same output directory.
+"""
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+
+from catalog import CATALOG_CSV
+from encode import IMAGE_FORMAT
+from imagestore import ImageStore, PRERENDER_DIR
+from manifest import catalog_prefixes
+
+SECTOR_COLUMNS = ['m1_combined', 'm2_combined']
+
+
+@lru_cache(maxsize=None)
+def worker_store(out_dir):
+
+    return ImageStore(out_dir)
+
+
+def render_granule(key, modes, out_dir, fmt):
+
+    # Runs in a worker process: one whole-object fetch, then every
+    # requested mode from the in-memory granule. Returns the index rows of
+    # the modes that rendered and the errors of those that did not.
+    from encode import encode_image
+    from granules import clear_granules, fetch_granules, load_granule
+    from render import mode_variables, rgb_pixels, uses_lut
+
+    store = worker_store(out_dir)
+    rows, errors = [], []
+    try:
+        fetch_granules([key])
+        for mode in modes:
+            try:
+                raw = uses_lut(mode)
+                ds = load_granule(key, mode_variables(mode), raw=raw)
+                pixels, colors = rgb_pixels(ds, mode, raw)
+                digest = store.put(encode_image(pixels, fmt, colors), fmt)
+                rows.append(dict(key=key, mode=mode.strip(), digest=digest, format=fmt))
+            except Exception as e:
+                errors.append(f'{mode.strip()}: {e}')
+    finally:
+        clear_granules()
+    return rows, errors
+
+
+def prerender(catalog_path, out_dir=PRERENDER_DIR, storms=None, columns=SECTOR_COLUMNS,
+              workers=None, fmt=IMAGE_FORMAT):
+
+    from granules import resolve_granules
+    from render import RGB_MODES
+
+    store = ImageStore(out_dir)
+    prefixes = catalog_prefixes(catalog_path, columns, storms=set(storms) if storms else None)
+    keys = [k for k in dict.fromkeys(resolve_granules(prefixes)) if k]
+
+    todo = {}
+    for key in keys:
+        missing = [m for m in RGB_MODES if (key, m.strip()) not in store]
+        if missing:
+            todo[key] = missing
+    print(f'{len(keys) - len(todo)} granules already rendered, {len(todo)} to go')
+
+    failed = 0
+    # spawn: workers must not inherit the parent's S3 event loop
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(render_granule, key, modes, out_dir, fmt): key
+                   for key, modes in todo.items()}
+        for i, future in enumerate(as_completed(futures), 1):
+            key = futures[future]
+            try:
+                rows, errors = future.result()
+            except Exception as e:
+                rows, errors = [], [str(e)]
+            store.record(rows)
+            if errors:
+                failed += 1
+                print(f'failed: {key}: {"; ".join(errors)}')
+            if i % 100 == 0:
+                print(f'{i}/{len(todo)}')
+
+    print(f'{len(store)} frames in {out_dir}, {failed} granules incomplete')
+    return store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('catalog', nargs='?', default=CATALOG_CSV)
+    parser.add_argument('-o', '--output', default=PRERENDER_DIR)
+    parser.add_argument('--storms', nargs='+', help='storm names as in the catalog (default: all)')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--format', choices=['png', 'webp'], default=IMAGE_FORMAT)
+    args = parser.parse_args()
+    prerender(args.catalog, args.output, args.storms, workers=args.workers, fmt=args.format)
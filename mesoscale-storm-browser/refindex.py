@@ -0,0 +1,264 @@
+"""Byte-range reference index for a storm's mesoscale granules.
+
+Each MCMIPM granule is scanned once with kerchunk to record where every
+chunk of every (y, x) variable lives in the netCDF file. The per-granule
+references are stacked into one virtual Zarr store per storm and sector, so
+the app can open a whole storm as a lazily loaded (t, y, x) dataset and
+read only the chunks it touches with ranged GETs.
+
+    python refindex.py "Hurricane Ida" --sector m1_combined
+
+Mesoscale sectors move during a storm, so the fixed-grid x/y coordinates
+are stored per time step as sector_x (t, x) and sector_y (t, y);
+granule_view() turns one time step back into a granule-shaped dataset.
+"""
+import argparse
+import base64
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from catalog import CATALOG_CSV
+from manifest import load_manifest
+
+REFS_DIR = 'data/refs'
+REFS_INDEX = os.path.join(REFS_DIR, 'index.csv')
+
+# Packing attributes that do not survive decoding x/y/t up front
+PACKING_ATTRS = ['scale_factor', 'add_offset', '_FillValue', '_Unsigned', 'valid_range']
+
+
+def _meta(refs, path):
+    value = refs.get(path)
+    return json.loads(value) if value is not None else None
+
+
+def _inline(values):
+    return 'base64:' + base64.b64encode(np.ascontiguousarray(values, dtype='<f8').tobytes()).decode()
+
+
+def _float_zarray(shape, chunks):
+    return json.dumps(dict(chunks=chunks, compressor=None, dtype='<f8', fill_value=None,
+                           filters=None, order='C', shape=shape, zarr_format=2))
+
+
+def unpacked(raw, attrs):
+
+    # Packed coordinate values (e.g. int16 x/y) decoded to float64
+    values = np.asarray(raw, dtype='f8')
+    return values * attrs.get('scale_factor', 1.0) + attrs.get('add_offset', 0.0)
+
+
+def scan_granule(fs, key, inline_threshold=300):
+
+    # kerchunk references plus the decoded x/y/t values for one granule
+    import h5py
+    from kerchunk.hdf import SingleHdf5ToZarr
+
+    url = key if '://' in key else f's3://{key}'
+    with fs.open(key, 'rb') as f:
+        refs = SingleHdf5ToZarr(f, url, inline_threshold=inline_threshold).translate()['refs']
+    with fs.open(key, 'rb') as f, h5py.File(f, 'r') as h5:
+        x, y, t = h5['x'][:], h5['y'][:], h5['t'][()]
+
+    return dict(key=key,
+                refs=refs,
+                x=unpacked(x, _meta(refs, 'x/.zattrs')),
+                y=unpacked(y, _meta(refs, 'y/.zattrs')),
+                t=float(t))
+
+
+def stack_granules(scans):
+
+    # Combine per-granule references into one (t, y, x) reference store
+    first = scans[0]['refs']
+    T = len(scans)
+    refs = {'.zgroup': first['.zgroup']}
+
+    names = sorted({k.split('/')[0] for k in first if '/' in k})
+    stacked, scalars = [], []
+    for name in names:
+        attrs = _meta(first, f'{name}/.zattrs') or {}
+        dims = attrs.get('_ARRAY_DIMENSIONS', [])
+        if name in ('x', 'y', 't'):
+            continue
+        if dims == ['y', 'x']:
+            stacked.append(name)
+        elif dims == []:
+            scalars.append(name)
+
+    for name in stacked:
+        zarray = _meta(first, f'{name}/.zarray')
+        zattrs = _meta(first, f'{name}/.zattrs')
+        for scan in scans[1:]:
+            if (_meta(scan['refs'], f'{name}/.zarray') != zarray or
+                    _meta(scan['refs'], f'{name}/.zattrs') != zattrs):
+                raise ValueError(f'{scan["key"]}: {name} layout differs from {scans[0]["key"]}')
+
+        refs[f'{name}/.zarray'] = json.dumps(dict(zarray, shape=[T] + zarray['shape'],
+                                                  chunks=[1] + zarray['chunks']))
+        refs[f'{name}/.zattrs'] = json.dumps(dict(zattrs, _ARRAY_DIMENSIONS=['t', 'y', 'x']))
+        for i, scan in enumerate(scans):
+            prefix = f'{name}/'
+            for k, v in scan['refs'].items():
+                if k.startswith(prefix) and not k[len(prefix):].startswith('.'):
+                    refs[f'{name}/{i}.{k[len(prefix):]}'] = v
+
+    # Scalar metadata (projection, extents) keeps the first granule's data;
+    # per-granule attributes are restored by granule_view()
+    for name in scalars:
+        for k, v in first.items():
+            if k.startswith(f'{name}/'):
+                refs[k] = v
+
+    for name, dim in (('x', 'x'), ('y', 'y')):
+        attrs = {k: v for k, v in _meta(first, f'{name}/.zattrs').items() if k not in PACKING_ATTRS}
+        n = len(scans[0][name])
+        refs[f'sector_{name}/.zarray'] = _float_zarray([T, n], [1, n])
+        refs[f'sector_{name}/.zattrs'] = json.dumps(dict(attrs, _ARRAY_DIMENSIONS=['t', dim]))
+        for i, scan in enumerate(scans):
+            if len(scan[name]) != n:
+                raise ValueError(f'{scan["key"]}: {name} has {len(scan[name])} points, expected {n}')
+            refs[f'sector_{name}/{i}.0'] = _inline(scan[name])
+
+    t_attrs = {k: v for k, v in _meta(first, 't/.zattrs').items() if k not in PACKING_ATTRS}
+    refs['t/.zarray'] = _float_zarray([T], [T])
+    refs['t/.zattrs'] = json.dumps(dict(t_attrs, _ARRAY_DIMENSIONS=['t']))
+    refs['t/0'] = _inline([scan['t'] for scan in scans])
+
+    root = _meta(first, '.zattrs') or {}
+    root['granules'] = [
+        dict(key=scan['key'],
+             attrs=_meta(scan['refs'], '.zattrs') or {},
+             scalar_attrs={name: _meta(scan['refs'], f'{name}/.zattrs') for name in scalars})
+        for scan in scans]
+    refs['.zattrs'] = json.dumps(root)
+
+    return {'version': 1, 'refs': refs}
+
+
+def storm_keys(catalog_path, storm_name, sector):
+
+    # (storm_id, [granule keys]) for the storm's rows, resolved via the manifest
+    manifest = load_manifest()
+    storm_id, keys = None, []
+    with open(catalog_path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['storm_name'] != storm_name:
+                continue
+            storm_id = row['storm_id']
+            entry = manifest.get(row[sector])
+            keys.append(entry['key'] if entry and entry['key'] else row[sector])
+    return storm_id, keys
+
+
+def resolve_key(fs, key):
+
+    # Prefixes that were never resolved by manifest.py still need a LIST
+    if key.endswith('.nc'):
+        return key
+    found = fs.glob(f'{key}*.nc')
+    return found[0] if found else None
+
+
+def build_storm_index(storm_name, sector='m1_combined', catalog_path=CATALOG_CSV,
+                      out_dir=REFS_DIR, workers=16, fs=None):
+
+    if fs is None:
+        import s3fs
+        fs = s3fs.S3FileSystem(anon=True)
+
+    storm_id, keys = storm_keys(catalog_path, storm_name, sector)
+    if not keys:
+        raise ValueError(f'No catalog rows for {storm_name!r}')
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        keys = [k for k in pool.map(lambda k: resolve_key(fs, k), keys) if k]
+        # Duplicate keys happen when consecutive catalog rows share a granule
+        keys = list(dict.fromkeys(keys))
+        scans = list(pool.map(lambda k: scan_granule(fs, k), keys))
+
+    scans.sort(key=lambda s: s['t'])
+    refs = stack_granules(scans)
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, f'{storm_id}_{sector.split("_")[0]}.json')
+    with open(out_path, 'w') as f:
+        json.dump(refs, f)
+
+    update_index(os.path.join(out_dir, 'index.csv'), 'refs', out_path, [scan['key'] for scan in scans])
+
+    print(f'{storm_name} {sector}: {len(scans)} granules -> {out_path}')
+    return out_path
+
+
+def load_index(path=REFS_INDEX):
+
+    # granule key -> {'refs' (or 'store' for stormzarr.py): the storm's
+    # file, 'position': time index}
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        return {row['key']: dict(row, position=int(row['position'])) for row in csv.DictReader(f)}
+
+
+def update_index(path, column, storm_path, keys):
+
+    # Replace storm_path's rows of the index at path with keys, in time
+    # order. Written to a temporary file and renamed into place: the app
+    # may be reading the index meanwhile.
+    index = {k: v for k, v in load_index(path).items() if v[column] != storm_path}
+    for i, key in enumerate(keys):
+        index[key] = {'key': key, column: storm_path, 'position': i}
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['key', column, 'position'])
+        writer.writeheader()
+        writer.writerows(index.values())
+    os.replace(tmp, path)
+
+
+def open_storm(refs_path, remote_protocol='s3', remote_options=None, **kwargs):
+
+    import fsspec
+    import xarray as xr
+
+    from metrics import CountingMapper
+
+    if remote_options is None and remote_protocol == 's3':
+        remote_options = {'anon': True}
+    fs = fsspec.filesystem('reference', fo=refs_path,
+                           remote_protocol=remote_protocol,
+                           remote_options=remote_options or {})
+    return xr.open_dataset(CountingMapper(fs.get_mapper(''), 'refs'), engine='zarr',
+                           consolidated=False, **kwargs)
+
+
+def granule_view(storm, position):
+
+    # One time step of a storm store, shaped like xr.open_dataset(granule)
+    info = storm.attrs['granules'][position]
+    ds = storm.isel(t=position)
+    ds = ds.assign_coords(x=('x', ds.sector_x.values, storm.sector_x.attrs),
+                          y=('y', ds.sector_y.values, storm.sector_y.attrs))
+    ds = ds.drop_vars(['sector_x', 'sector_y'])
+    ds.attrs = dict(info['attrs'])
+    for name, attrs in info['scalar_attrs'].items():
+        if name in ds and attrs:
+            ds[name].attrs = {k: v for k, v in attrs.items() if k != '_ARRAY_DIMENSIONS'}
+    return ds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('storms', nargs='+')
+    parser.add_argument('--sector', default='m1_combined', choices=['m1_combined', 'm2_combined'])
+    parser.add_argument('--catalog', default=CATALOG_CSV)
+    parser.add_argument('-o', '--output', default=REFS_DIR)
+    parser.add_argument('-j', '--workers', type=int, default=16)
+    args = parser.parse_args()
+    for storm in args.storms:
+        build_storm_index(storm, args.sector, args.catalog, args.output, args.workers)
@@ -0,0 +1,203 @@
+import os
+from functools import lru_cache
+
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from composite import KERNELS, composite
+from encode import data_uri, encode_image, palette, palette_indices, to_uint8
+from figstore import FigureStore, figure_key
+from imagestore import ImageStore, PRERENDER_DIR
+from granules import fetch_granules, load_granule
+from lut import lut_composite
+from metrics import span
+from rgb import *
+from viewport import block_average
+
+# Rendered figures live on the server; the browser only ever sees the one
+# being displayed. Set FIGURE_SPILL_DIR to keep evicted figures on disk.
+FIGURE_STORE_MB = int(os.environ.get('FIGURE_STORE_MB', 512))
+FIGURE_SPILL_DIR = os.environ.get('FIGURE_SPILL_DIR')
+
+figure_store = FigureStore(FIGURE_STORE_MB * 2**20, spill_dir=FIGURE_SPILL_DIR)
+
+# Composites pre-rendered by prerender.py are served from here when present
+prerendered = ImageStore(PRERENDER_DIR)
+
+SECTOR_TITLES = ('Mesoscale 1', 'Mesoscale 2')
+
+# Build composites from raw CMI counts through lookup tables (lut.py)
+LUT_COMPOSITES = os.environ.get('LUT_COMPOSITES', '1') == '1'
+
+# RGB selector label -> (rgb.py recipe, recipe keyword arguments).
+# Enhanced IR has no recipe; it is a colormapped view of the Clean IR band.
+RGB_MODES = {
+    ' Natural Color': ('NaturalColor', dict(gamma=0.9, night_IR=True)),
+    ' Enhanced IR': (None, {}),
+    ' (Day) Cloud Convection': ('DayCloudConvection', {}),
+    ' (Day) Convection': ('DayConvection', {}),
+    ' (Day) Cloud Phase': ('DayCloudPhase', {}),
+    ' Air Mass': ('AirMass', {}),
+    ' Water Vapor': ('WaterVapor', {}),
+    ' Differential Water Vapor': ('DifferentialWaterVapor', {}),
+}
+
+
+# Enhanced IR colorscale over the image's C13 range, coldest first: a
+# colored ramp for the cold cloud tops into greyscale for warmer scenes
+ENHANCED_IR_COLORS = [
+    [0.00, '#ffffff'],
+    [0.06, '#ff00ff'],
+    [0.14, '#ff0000'],
+    [0.24, '#ffa500'],
+    [0.32, '#ffff00'],
+    [0.40, '#00c000'],
+    [0.48, '#0000ff'],
+    [0.54, '#00ffff'],
+    [0.56, '#d0d0d0'],
+    [1.00, '#000000'],
+]
+
+
+def mode_variables(mode):
+
+    recipe, _ = RGB_MODES[mode]
+    return channel_variables(RGB_CHANNELS[recipe] if recipe else (13,))
+
+
+def no_image_note(storm_name):
+
+    return f'No Mesoscale Image<br>of {storm_name}<br>at This Time'
+
+
+def uses_lut(mode):
+
+    recipe, _ = RGB_MODES[mode]
+    return LUT_COMPOSITES and recipe in KERNELS
+
+
+@lru_cache(maxsize=None)
+def ir_palette():
+
+    # ENHANCED_IR_COLORS sampled once into the 256 colors Enhanced IR is drawn with
+    return palette(ENHANCED_IR_COLORS)
+
+
+def image_fig(source, window=None, factor=1):
+
+    # The composite goes over the wire as one 8-bit PNG/WebP (see encode.py)
+    # rather than as JSON floats. Axes are in full-resolution sector pixels
+    # whatever the crop window and block size, so a zoomed-in range stays
+    # put when the full-resolution image replaces the reduced one.
+    y0, x0 = (window['y'][0], window['x'][0]) if window else (0, 0)
+    offset = (factor - 1) / 2
+    return (go.Figure(go.Image(source=source, x0=x0 + offset, dx=factor, y0=y0 + offset, dy=factor))
+            .update_layout(margin=dict(l=10, r=10, b=10, t=10), uirevision='image')
+            .update_traces(hovertemplate=None, hoverinfo='skip')
+            .update_xaxes(visible=False)
+            .update_yaxes(visible=False, autorange='reversed', scaleanchor='x'))
+
+
+def rgb_pixels(ds, mode, raw=False):
+
+    # (pixels, palette) of a mode: (y, x, 3) uint8 and None for the RGB
+    # recipes, palette indices and ir_palette() for Enhanced IR.
+    # raw: ds holds packed counts (see uses_lut) rather than decoded values
+    recipe, kwargs = RGB_MODES[mode]
+
+    if recipe is None:
+        # Colormapped here rather than in the browser, scaled to the data
+        # range as px.imshow did
+        return palette_indices(ds.CMI_C13), ir_palette()
+
+    # The rgb.py recipe, evaluated by the float32 engine or from lookup
+    # tables over the raw counts
+    rgb = lut_composite(ds, recipe, **kwargs) if raw else composite(ds, recipe, **kwargs)
+    return to_uint8(rgb), None
+
+
+def make_rgb_fig(ds, mode, raw=False, window=None, factor=1):
+
+    pixels, colors = rgb_pixels(ds, mode, raw)
+    return image_fig(data_uri(encode_image(pixels, colors=colors)), window, factor)
+
+
+def add_note(fig, text):
+
+    return fig.add_annotation(
+        x=0.5,
+        y=0.5,
+        text=text,
+        xref='paper',
+        yref='paper',
+        showarrow=False,
+        font_size=30,
+        font_color='cyan',
+        bordercolor="gray",
+        bgcolor="gray",
+        opacity=0.8)
+
+
+def render_rgb(granule, mode, note=None, checkpoint=None, window=None, factor=1):
+
+    # Only the composite the user is looking at is ever built, and each
+    # (granule, mode) pair is built once while it stays in the figure store.
+    # checkpoint() is called between stages and may raise to abandon the
+    # render when a newer request has come in. window crops to a pixel
+    # window (see geoloc.crop_window) before anything is read, and factor
+    # block-averages the inputs to the panel's size (see viewport.py).
+    checkpoint = checkpoint or (lambda: None)
+
+    key = figure_key(granule, mode, note, window, factor)
+    fig = figure_store.get(key)
+    if fig is None:
+        image = None if window or factor > 1 else prerendered.get(granule, mode.strip())
+        if image is not None:
+            fig = image_fig(data_uri(*image))
+        else:
+            raw = uses_lut(mode)
+            with span('rgb read'):
+                ds = load_granule(granule, mode_variables(mode), raw=raw, window=window)
+            checkpoint()
+            with span('composite'):
+                ds = block_average(ds, factor)
+                fig = make_rgb_fig(ds, mode, raw=raw, window=window, factor=factor)
+        if note:
+            add_note(fig, note)
+        checkpoint()
+        with span('serialize'):
+            fig = figure_store.put(key, fig)
+    return fig
+
+
+def render_pair(granules, mode, note=None, checkpoint=None, factor=1):
+
+    # Both mesoscale sectors side by side. The two granules are fetched in
+    # one concurrent batch, then each panel is built (and kept) exactly as
+    # render_rgb builds a single view.
+    checkpoint = checkpoint or (lambda: None)
+
+    key = figure_key(*granules, mode, note, factor)
+    fig = figure_store.get(key)
+    if fig is None:
+        with span('fetch'):
+            fetch_granules(granules)
+        checkpoint()
+        panels = [render_rgb(granule, mode, checkpoint=checkpoint, factor=factor) for granule in granules]
+        with span('composite'):
+            fig = make_subplots(rows=1, cols=len(panels), subplot_titles=SECTOR_TITLES,
+                                horizontal_spacing=0.02)
+            for col, panel in enumerate(panels, 1):
+                for trace in panel['data']:
+                    fig.add_trace(trace, row=1, col=col)
+                fig.update_yaxes(autorange=panel['layout']['yaxis'].get('autorange', True),
+                                 scaleanchor='x' if col == 1 else f'x{col}', row=1, col=col)
+            fig.update_layout(margin=dict(l=10, r=10, b=10, t=30), uirevision='image')
+            fig.update_xaxes(visible=False)
+            fig.update_yaxes(visible=False)
+            if note:
+                add_note(fig, note)
+        checkpoint()
+        with span('serialize'):
+            fig = figure_store.put(key, fig)
+    return fig
@@ -1,9 +1,30 @@
 
 import numpy as np
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
 import xarray as xr
 
+from geoloc import geostationary_crs, latlon_grid
+
+# ABI channels read by each recipe, so loaders can decode only the bands a
+# composite actually uses instead of all 16
+RGB_CHANNELS = {
+    "TrueColor": (1, 2, 3, 13),
+    "NaturalColor": (1, 2, 3, 13),
+    "DayCloudPhase": (2, 5, 13),
+    "DayConvection": (2, 5, 7, 8, 10, 13),
+    "DayCloudConvection": (2, 13),
+    "WaterVapor": (8, 10, 13),
+    "DifferentialWaterVapor": (8, 10),
+    "AirMass": (8, 10, 12, 13),
+}
+
+# Non-channel variables rgb_as_dataset reads from the granule
+RGB_SUPPORT_VARIABLES = ["goes_imager_projection", "geospatial_lat_lon_extent"]
+
+
+def channel_variables(channels):
+
+    return ["CMI_C%02d" % c for c in sorted(set(channels))] + RGB_SUPPORT_VARIABLES
+
 
 def get_imshow_kwargs(ds):
 
@@ -22,7 +43,7 @@ def rgb_as_dataset(G, RGB, description, latlon=False):
     ds.attrs["description"] = description
 
     # Convert x, y points to latitude/longitude
-    _, crs = field_of_view(G)
+    crs = geostationary_crs(G)
     sat_h = G.goes_imager_projection.perspective_point_height
     x2 = G.x * sat_h
     y2 = G.y * sat_h
@@ -35,9 +56,8 @@ def rgb_as_dataset(G, RGB, description, latlon=False):
     ds.attrs["crs"] = crs
 
     if latlon:
-        X, Y = np.meshgrid(x2, y2)
-        a = ccrs.PlateCarree().transform_points(crs, X, Y)
-        lons, lats, _ = a[:, :, 0], a[:, :, 1], a[:, :, 2]
+        # Cached per sector geometry; repeat sectors cost nothing
+        lats, lons = latlon_grid(G)
         ds.coords["longitude"] = (("y", "x"), lons)
         ds.coords["latitude"] = (("y", "x"), lats)
 
@@ -249,6 +269,27 @@ def DayCloudConvection(C, **kwargs):
 
 
 
+def AirMass(C, **kwargs):
+
+    # Load the three channels into appropriate R, G, and B variables.
+    # NOTE: R and G are channel differences.
+    R = C["CMI_C08"].data - C["CMI_C10"].data
+    G = C["CMI_C12"].data - C["CMI_C13"].data
+    B = C["CMI_C08"].data - 273.15
+
+    # Normalize each channel by the appropriate range of values.
+    # (B's range runs backwards, which inverts it)
+    R = normalize(R, -26.2, 0.6)
+    G = normalize(G, -43.2, 6.7)
+    B = normalize(B, -29.25, -64.65)
+
+    # The final RGB array :)
+    RGB = np.dstack([R, G, B])
+
+    return rgb_as_dataset(C, RGB, "Air Mass", **kwargs)
+
+
+
 def WaterVapor(C, **kwargs):
    
     # Load the three channels into appropriate R, G, and B variables.
@@ -0,0 +1,49 @@
+import importlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Heavy modules (xarray, s3fs, plotly express, the compositing code) are
+# imported by the callbacks on first use. WARMUP=1 imports them in a
+# background thread right after startup instead, and WARMUP_S3=1 also opens
+# a granule there to set up the S3 connection pool.
+WARMUP = os.environ.get('WARMUP', '1') == '1'
+WARMUP_S3 = os.environ.get('WARMUP_S3', '0') == '1'
+WARMUP_MODULES = ['granules', 'render']
+PROBE_KEY = 'noaa-goes16/ABI-L2-MCMIPM/2021/241/14/OR_ABI-L2-MCMIPM1-M6_G16_s20212411400278_e20212411400347_c20212411400421.nc'
+
+import_times = []
+
+
+@contextmanager
+def timed(label):
+
+    start = time.time()
+    yield
+    import_times.append((label, time.time() - start))
+
+
+def report_imports():
+
+    for label, seconds in import_times:
+        print(f'Page load: import {label}: \n\t{seconds}')
+
+
+def warm_up(modules=WARMUP_MODULES, probe=WARMUP_S3):
+
+    def run():
+        for name in modules:
+            start = time.time()
+            importlib.import_module(name)
+            print(f'Warm-up: import {name}: \n\t{time.time() - start}')
+        if probe:
+            from granules import get_store
+            start = time.time()
+            store = get_store()
+            store.open(PROBE_KEY).close()
+            print(f'Warm-up: {store.name} open connection: \n\t{time.time() - start}')
+
+    thread = threading.Thread(target=run, name='warmup', daemon=True)
+    thread.start()
+    return thread
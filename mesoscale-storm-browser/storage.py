@@ -0,0 +1,224 @@
+import fnmatch
+import glob
+import os
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+from urllib.parse import quote
+
+# Where granules are read from: s3 (anonymous, the default), http (ranged
+# GETs against the public bucket URL), local (a directory laid out like the
+# bucket, e.g. one written by mirror.py) or mirror (local, falling back to
+# S3 for anything not mirrored)
+GRANULE_STORE = os.environ.get('GRANULE_STORE', 's3')
+GRANULE_DIR = os.environ.get('GRANULE_DIR', 'data/granules')
+GRANULE_HTTP_URL = os.environ.get('GRANULE_HTTP_URL', 'https://{bucket}.s3.amazonaws.com')
+
+# Point at an S3-compatible endpoint other than AWS (e.g. bench.py's local
+# stand-in)
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+# Keep-alive connections held open to S3 for concurrent fetches
+S3_MAX_CONNECTIONS = int(os.environ.get('S3_MAX_CONNECTIONS', 32))
+# Read size for files opened for ranged reads (open(key, ranged=True)).
+# fsspec's default 5 MiB readahead would pull a whole ~4 MB granule on the
+# first superblock read; this is about one compressed HDF5 chunk.
+RANGED_BLOCK_SIZE = int(os.environ.get('RANGED_BLOCK_SIZE', 64 * 1024))
+
+
+def object_key(url):
+
+    # Catalog entries carry an s3:// scheme; keys are bucket/path
+    return url[len('s3://'):] if url.startswith('s3://') else url
+
+
+class Storage(ABC):
+
+    # The slice of the fsspec interface the app uses. Keys are bucket/path
+    # as s3fs returns them; glob(detail=True) maps key -> {'size', 'ETag'}.
+
+    name = None
+
+    @abstractmethod
+    def glob(self, pattern, detail=False):
+        pass
+
+    @abstractmethod
+    def open(self, key, ranged=False):
+        # ranged: reads fetch RANGED_BLOCK_SIZE blocks rather than a
+        # multi-megabyte readahead, for reading a few chunks of an object
+        pass
+
+    def cat(self, keys):
+
+        # Whole objects as {key: bytes}; remote stores fetch them concurrently
+        out = {}
+        for key in keys:
+            with self.open(key) as f:
+                out[key] = f.read()
+        return out
+
+    def info(self, key):
+        found = self.glob(key, detail=True)
+        if key not in found:
+            raise FileNotFoundError(key)
+        return found[key]
+
+    def exists(self, key):
+        return bool(self.glob(key))
+
+    def invalidate_cache(self):
+        pass
+
+
+class S3Storage(Storage):
+
+    name = 's3'
+
+    def __init__(self, endpoint_url=S3_ENDPOINT_URL):
+        # s3fs is slow to import, so it is only loaded when this is chosen
+        import s3fs
+        client_kwargs = {'endpoint_url': endpoint_url} if endpoint_url else None
+        self.fs = s3fs.S3FileSystem(anon=True, client_kwargs=client_kwargs,
+                                    config_kwargs={'max_pool_connections': S3_MAX_CONNECTIONS})
+
+    def glob(self, pattern, detail=False):
+        return self.fs.glob(object_key(pattern), detail=detail)
+
+    def open(self, key, ranged=False):
+        if ranged:
+            return self.fs.open(object_key(key), block_size=RANGED_BLOCK_SIZE, cache_type='bytes')
+        return self.fs.open(object_key(key))
+
+    def cat(self, keys):
+        # One batch of GETs gathered on s3fs's event loop
+        paths = {object_key(k): k for k in keys}
+        return {paths[p]: data for p, data in self.fs.cat(list(paths)).items()}
+
+    def info(self, key):
+        return self.fs.info(object_key(key))
+
+    def exists(self, key):
+        return self.fs.exists(object_key(key))
+
+    def invalidate_cache(self):
+        self.fs.invalidate_cache()
+
+
+class HTTPStorage(Storage):
+
+    # Public buckets over plain HTTPS: objects are read with ranged GETs,
+    # and listings use the bucket's ListObjectsV2 endpoint
+
+    name = 'http'
+
+    def __init__(self, base_url=GRANULE_HTTP_URL):
+        import fsspec
+        self.base_url = base_url
+        self.fs = fsspec.filesystem('https')
+
+    def url(self, key):
+        bucket, path = object_key(key).split('/', 1)
+        return f'{self.base_url.format(bucket=bucket)}/{path}'
+
+    def _list(self, bucket, prefix):
+
+        ns = {'s3': 'http://s3.amazonaws.com/doc/2006-03-01/'}
+        token = None
+        while True:
+            query = f'?list-type=2&prefix={quote(prefix)}'
+            if token:
+                query += f'&continuation-token={quote(token)}'
+            root = ET.fromstring(self.fs.cat(self.base_url.format(bucket=bucket) + '/' + query))
+            for item in root.iterfind('s3:Contents', ns):
+                yield (f'{bucket}/{item.findtext("s3:Key", namespaces=ns)}',
+                       {'size': int(item.findtext('s3:Size', namespaces=ns)),
+                        'ETag': item.findtext('s3:ETag', namespaces=ns)})
+            if root.findtext('s3:IsTruncated', namespaces=ns) != 'true':
+                break
+            token = root.findtext('s3:NextContinuationToken', namespaces=ns)
+
+    def glob(self, pattern, detail=False):
+
+        # LIST everything under the literal part of the pattern, then match
+        bucket, path = object_key(pattern).split('/', 1)
+        prefix = path.split('*', 1)[0].split('?', 1)[0]
+        pattern = object_key(pattern)
+        found = {k: v for k, v in self._list(bucket, prefix) if fnmatch.fnmatchcase(k, pattern)}
+        return found if detail else sorted(found)
+
+    def open(self, key, ranged=False):
+        if ranged:
+            return self.fs.open(self.url(key), mode='rb', block_size=RANGED_BLOCK_SIZE, cache_type='bytes')
+        return self.fs.open(self.url(key), mode='rb')
+
+    def cat(self, keys):
+        urls = {self.url(k): k for k in keys}
+        return {urls[u]: data for u, data in self.fs.cat(list(urls)).items()}
+
+
+class LocalStorage(Storage):
+
+    name = 'local'
+
+    def __init__(self, root=GRANULE_DIR):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *object_key(key).split('/'))
+
+    def glob(self, pattern, detail=False):
+
+        found = {}
+        for path in glob.glob(self.path(pattern)):
+            key = os.path.relpath(path, self.root).replace(os.sep, '/')
+            found[key] = {'size': os.path.getsize(path), 'ETag': ''}
+        return found if detail else sorted(found)
+
+    def open(self, key, ranged=False):
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+
+class MirrorStorage(Storage):
+
+    # A local mirror in front of a remote store; keys that were not
+    # mirrored are read from the remote
+
+    name = 'mirror'
+
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def glob(self, pattern, detail=False):
+        return self.local.glob(pattern, detail) or self.remote.glob(pattern, detail)
+
+    def open(self, key, ranged=False):
+        if self.local.exists(key):
+            return self.local.open(key)
+        return self.remote.open(key, ranged)
+
+    def cat(self, keys):
+        local = [k for k in keys if self.local.exists(k)]
+        remote = [k for k in keys if k not in local]
+        out = self.local.cat(local)
+        if remote:
+            out.update(self.remote.cat(remote))
+        return out
+
+    def invalidate_cache(self):
+        self.remote.invalidate_cache()
+
+
+def make_store(kind=GRANULE_STORE, root=GRANULE_DIR):
+
+    if kind == 's3':
+        return S3Storage()
+    if kind == 'http':
+        return HTTPStorage()
+    if kind == 'local':
+        return LocalStorage(root)
+    if kind == 'mirror':
+        return MirrorStorage(LocalStorage(root), S3Storage())
+    raise ValueError(f'Unknown GRANULE_STORE {kind!r}: expected s3, http, local or mirror')
@@ -0,0 +1,152 @@
+"""Convert a storm's mesoscale granules into one chunked Zarr store.
+
+Every MCMIPM granule the catalog lists for a storm and sector is read once
+and its CMI bands are appended, still as packed 16-bit counts, to a single
+(t, y, x) Zarr store with consolidated metadata:
+
+    python stormzarr.py "Hurricane Ida" --sector m1_combined -o data/zarr
+
+Chunks are one time step by ZARR_CHUNK x ZARR_CHUNK pixels (125, so a
+500 x 500 sector is a 4 x 4 grid and a storm-centred crop touches a few
+chunks), compressed with Zstandard after bit shuffling. The layout matches
+refindex.py's: sector_x (t, x) and sector_y (t, y) hold each step's
+fixed-grid coordinates and per-granule attributes live in the root
+attributes, so refindex.granule_view() turns a time step back into a
+granule-shaped dataset. The app reads storms listed in data/zarr/index.csv
+from here, one time step (and only the chunks it decodes) per slider move.
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from catalog import CATALOG_CSV
+from refindex import PACKING_ATTRS, load_index, resolve_key, storm_keys, unpacked, update_index
+
+ZARR_DIR = 'data/zarr'
+ZARR_INDEX = os.path.join(ZARR_DIR, 'index.csv')
+
+ZARR_CHUNK = int(os.environ.get('ZARR_CHUNK', 125))
+# Granules read and appended per write
+ZARR_BATCH = 32
+
+# Scalar variables carried over from the granules
+SCALAR_VARIABLES = ['goes_imager_projection', 'geospatial_lat_lon_extent']
+
+
+def _jsonable(attrs):
+
+    out = {}
+    for k, v in attrs.items():
+        if isinstance(v, np.ndarray):
+            v = v.tolist()
+        elif isinstance(v, np.generic):
+            v = v.item()
+        out[k] = v
+    return out
+
+
+def read_granule(store, key):
+
+    # Packed CMI counts and metadata of one granule, read in full
+    import xarray as xr
+
+    with store.open(key) as f:
+        ds = xr.open_dataset(f, mask_and_scale=False)
+        bands = sorted(v for v in ds.data_vars if v.startswith('CMI_C') and ds[v].dims == ('y', 'x'))
+        scalars = [v for v in SCALAR_VARIABLES if v in ds]
+        ds = ds[bands + scalars].load()
+
+    x_attrs = {k: v for k, v in ds.x.attrs.items() if k not in PACKING_ATTRS}
+    y_attrs = {k: v for k, v in ds.y.attrs.items() if k not in PACKING_ATTRS}
+    step = xr.Dataset({name: (('t', 'y', 'x'), ds[name].values[np.newaxis], ds[name].attrs)
+                       for name in bands})
+    step['sector_x'] = (('t', 'x'), unpacked(ds.x.values, ds.x.attrs)[np.newaxis], x_attrs)
+    step['sector_y'] = (('t', 'y'), unpacked(ds.y.values, ds.y.attrs)[np.newaxis], y_attrs)
+    step = step.assign_coords(t=('t', [ds.t.values]))
+
+    info = dict(key=key,
+                attrs=_jsonable(ds.attrs),
+                scalar_attrs={name: _jsonable(ds[name].attrs) for name in scalars})
+    return step, ds[scalars], info
+
+
+def build_storm_zarr(storm_name, sector='m1_combined', catalog_path=CATALOG_CSV,
+                     out_dir=ZARR_DIR, workers=8, store=None):
+
+    import xarray as xr
+    import zarr
+    from numcodecs import Blosc
+
+    if store is None:
+        from granules import get_store
+        store = get_store()
+
+    storm_id, keys = storm_keys(catalog_path, storm_name, sector)
+    if not keys:
+        raise ValueError(f'No catalog rows for {storm_name!r}')
+
+    compressor = Blosc(cname='zstd', clevel=5, shuffle=Blosc.BITSHUFFLE)
+    out_path = os.path.join(out_dir, f'{storm_id}_{sector.split("_")[0]}.zarr')
+    granules = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        keys = [k for k in pool.map(lambda k: resolve_key(store, k), keys) if k]
+        # Duplicate keys happen when consecutive catalog rows share a granule;
+        # the start time in the file name orders the rest
+        keys = sorted(dict.fromkeys(keys), key=lambda k: k.rsplit('_s', 1)[-1])
+
+        for start in range(0, len(keys), ZARR_BATCH):
+            batch = list(pool.map(lambda k: read_granule(store, k), keys[start:start + ZARR_BATCH]))
+            ds = xr.concat([step for step, _, _ in batch], dim='t')
+            granules += [info for _, _, info in batch]
+            if start == 0:
+                ds = ds.merge(batch[0][1])
+                encoding = {name: {'chunks': (1, ZARR_CHUNK, ZARR_CHUNK), 'compressor': compressor}
+                            for name in ds.data_vars if name.startswith('CMI_C')}
+                ds.to_zarr(out_path, mode='w', encoding=encoding, consolidated=False)
+            else:
+                ds.to_zarr(out_path, append_dim='t', consolidated=False)
+            print(f'{len(granules)}/{len(keys)}')
+
+    group = zarr.open_group(out_path, mode='r+')
+    group.attrs.update(granules[0]['attrs'], granules=granules)
+    zarr.consolidate_metadata(out_path)
+
+    update_index(os.path.join(out_dir, 'index.csv'), 'store', out_path, [info['key'] for info in granules])
+
+    print(f'{storm_name} {sector}: {len(granules)} granules -> {out_path}')
+    return out_path
+
+
+def load_zarr_index(path=ZARR_INDEX):
+
+    # granule key -> {'store': Zarr store, 'position': time index}
+    return load_index(path)
+
+
+@lru_cache(maxsize=8)
+def open_storm_zarr(path, raw=False):
+
+    # Lazily indexed (no dask): selecting one time step and loading a
+    # variable reads just that step's chunks of it
+    import fsspec
+    import xarray as xr
+
+    from metrics import CountingMapper
+
+    return xr.open_zarr(CountingMapper(fsspec.get_mapper(path), 'zarr'), consolidated=True,
+                        chunks=None, mask_and_scale=not raw)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('storms', nargs='+')
+    parser.add_argument('--sector', default='m1_combined', choices=['m1_combined', 'm2_combined'])
+    parser.add_argument('--catalog', default=CATALOG_CSV)
+    parser.add_argument('-o', '--output', default=ZARR_DIR)
+    parser.add_argument('-j', '--workers', type=int, default=8)
+    args = parser.parse_args()
+    for storm in args.storms:
+        build_storm_zarr(storm, args.sector, args.catalog, args.output, args.workers)
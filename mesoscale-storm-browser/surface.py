@@ -0,0 +1,72 @@
+import math
+import os
+import warnings
+
+import numpy as np
+
+# Brightness temperature (K) below which a block is treated as cold cloud
+# top and keeps its minimum, so the deepest convection is not averaged away
+COLD_CLOUD_K = 235.0
+
+# The Infrared Reflectance panel is ~300 px tall; about one vertex every
+# three pixels is as much as the browser can show
+SURFACE_VERTICES = 100 * 100
+
+# Side in pixels of the storm core crop to show instead of the full sector
+# (SURFACE_CORE=0, the default, shows the full sector)
+SURFACE_CORE = int(os.environ.get('SURFACE_CORE', 0)) or None
+
+
+def decimation_factor(shape, max_vertices=SURFACE_VERTICES):
+
+    return max(1, math.ceil(math.sqrt(shape[0] * shape[1] / max_vertices)))
+
+
+def block_reduce(z, factor, cold=COLD_CLOUD_K):
+
+    # factor x factor blocks: min where the block reaches cold cloud top
+    # temperatures, mean everywhere else
+    if factor == 1:
+        return np.asarray(z)
+    ny, nx = (s // factor * factor for s in z.shape)
+    blocks = np.asarray(z)[:ny, :nx].reshape(ny // factor, factor, nx // factor, factor)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low = np.nanmin(blocks, axis=(1, 3))
+        mean = np.nanmean(blocks, axis=(1, 3))
+    return np.where(low < cold, low, mean)
+
+
+def block_mean_1d(v, factor):
+
+    v = np.asarray(v)
+    n = len(v) // factor * factor
+    return v[:n].reshape(-1, factor).mean(axis=1)
+
+
+def core_window(z, size):
+
+    # size x size window centred on the coldest pixel
+    ny, nx = z.shape
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        r, c = np.unravel_index(np.nanargmin(z), z.shape)
+    half = size // 2
+    r0 = min(max(r - half, 0), max(ny - size, 0))
+    c0 = min(max(c - half, 0), max(nx - size, 0))
+    return slice(r0, r0 + size), slice(c0, c0 + size)
+
+
+def surface_grid(x, y, z, max_vertices=SURFACE_VERTICES, core=None):
+
+    # Decimated (x, y, z) for go.Surface within a vertex budget. core=N
+    # instead covers the N x N pixels around the storm core (the coldest
+    # cloud tops), at full resolution when N*N fits the budget.
+    z = np.asarray(z)
+    x, y = np.asarray(x), np.asarray(y)
+    if core:
+        rows, cols = core_window(z, core)
+        x, y, z = x[cols], y[rows], z[rows, cols]
+
+    factor = decimation_factor(z.shape, max_vertices)
+    return block_mean_1d(x, factor), block_mean_1d(y, factor), block_reduce(z, factor)
@@ -0,0 +1,90 @@
+"""Composite whole storms in one pass.
+
+The functions here take a dataset whose CMI channels are stacked along a
+time dimension t, e.g. refindex.open_storm() or xr.concat of granules, and
+return every frame of a composite at once. Frames are read and composited
+in chunks of `frames` time steps to bound memory, and coordinates and
+attributes are built once for the whole stack rather than per granule.
+
+    storm = refindex.open_storm('data/refs/2021al09_m1.json')
+    ds = rgb_stack(storm, 'DayCloudPhase')
+
+Pass raw=True for stacks opened with mask_and_scale=False to composite from
+lookup tables over the packed counts (see lut.py); dtype=np.uint8 then gives
+0-255 frames.
+"""
+import numpy as np
+import xarray as xr
+
+from composite import KERNELS, composite
+from lut import lut_composite
+from rgb import RGB_CHANNELS
+
+# Granule attributes rgb_as_dataset carries over to a composite
+FRAME_ATTRS = [
+    "orbital_slot",
+    "platform_ID",
+    "scene_id",
+    "spatial_resolution",
+    "instrument_type",
+    "title",
+]
+
+
+def _stack_coords(S, frames):
+
+    coords = {"t": S.t.isel(t=frames)}
+    for name in ("x", "y"):
+        if f"sector_{name}" in S.variables:
+            # Moving sector: fixed-grid coordinates per time step
+            coords[f"sector_{name}"] = S[f"sector_{name}"].isel(t=frames)
+        elif name in S.coords:
+            coords[name] = S[name]
+    return coords
+
+
+def stack_as_dataset(S, RGB, description, frames=slice(None)):
+
+    ds = xr.Dataset({description.replace(" ", ""): (["t", "y", "x", "rgb"], RGB)},
+                    coords=_stack_coords(S, frames))
+    ds.attrs["description"] = description
+    for i in FRAME_ATTRS:
+        if i in S.attrs:
+            ds.attrs[i] = S.attrs[i]
+    return ds
+
+
+def _composite_frames(S, recipe, frames, out, raw, **options):
+
+    names = ["CMI_C%02d" % c for c in RGB_CHANNELS[recipe]]
+    chunk = S[names].isel(t=frames).load()
+    if raw:
+        return lut_composite(chunk, recipe, dtype=out.dtype, out=out, **options)
+    return composite(chunk, recipe, out=out, **options)
+
+
+def iter_rgb_stack(S, recipe, frames=16, raw=False, dtype=np.float32, **options):
+
+    # Yield the composite as one dataset per chunk of frames
+    _, description = KERNELS[recipe]
+    first = S["CMI_C%02d" % RGB_CHANNELS[recipe][0]]
+    T = S.sizes["t"]
+    for t0 in range(0, T, frames):
+        sel = slice(t0, min(t0 + frames, T))
+        out = np.empty((sel.stop - t0,) + first.shape[1:] + (3,), dtype=dtype if raw else np.float32)
+        _composite_frames(S, recipe, sel, out, raw, **options)
+        yield stack_as_dataset(S, out, description, sel)
+
+
+def rgb_stack(S, recipe, frames=16, raw=False, dtype=np.float32, **options):
+
+    # All frames of a composite as one (t, y, x, rgb) dataset. Output is
+    # preallocated once and each chunk is composited straight into it.
+    _, description = KERNELS[recipe]
+    first = S["CMI_C%02d" % RGB_CHANNELS[recipe][0]]
+    out = np.empty(first.shape + (3,), dtype=dtype if raw else np.float32)
+    T = S.sizes["t"]
+    for t0 in range(0, T, frames):
+        sel = slice(t0, min(t0 + frames, T))
+        _composite_frames(S, recipe, sel, out[sel], raw, **options)
+    return stack_as_dataset(S, out, description)
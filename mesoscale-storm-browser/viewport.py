@@ -0,0 +1,99 @@
+import os
+import warnings
+
+import numpy as np
+
+from surface import block_mean_1d
+
+# Size in device pixels assumed for the image panel until the browser has
+# reported its own; ADAPTIVE_RESOLUTION=0 always renders at full resolution
+VIEWPORT_PIXELS = int(os.environ.get('VIEWPORT_PIXELS', 900))
+ADAPTIVE_RESOLUTION = os.environ.get('ADAPTIVE_RESOLUTION', '1') == '1'
+
+# Browser side: the image panel's size in device pixels, reported once per
+# page load into the viewport store
+REPORT_VIEWPORT = """
+function(session) {
+    const graph = document.getElementById('image-graph');
+    if (!graph) {
+        return window.dash_clientside.no_update;
+    }
+    const ratio = window.devicePixelRatio || 1;
+    return {width: Math.round(graph.clientWidth * ratio),
+            height: Math.round(graph.clientHeight * ratio)};
+}
+"""
+
+
+def output_factor(shape, viewport=None, panels=1):
+
+    # Largest block size that keeps the image at least as large as its
+    # panel (one of `panels` side by side) in both directions
+    if not ADAPTIVE_RESOLUTION:
+        return 1
+    viewport = viewport or {'width': VIEWPORT_PIXELS, 'height': VIEWPORT_PIXELS}
+    width = max(int(viewport['width']) // panels, 1)
+    height = max(int(viewport['height']), 1)
+    return max(1, min(shape[0] // height, shape[1] // width))
+
+
+def is_zoomed(relayout):
+
+    # Plotly relayoutData carries axis ranges after a zoom and autorange
+    # flags after a reset
+    return bool(relayout) and any(k.startswith(('xaxis.range', 'yaxis.range')) for k in relayout)
+
+
+def is_view_change(relayout):
+
+    return bool(relayout) and any(k.startswith(('xaxis.', 'yaxis.')) for k in relayout)
+
+
+def _block_mean(a, factor, fill=None):
+
+    ny, nx = (s // factor * factor for s in a.shape)
+    blocks = a[:ny, :nx].reshape(ny // factor, factor, nx // factor, factor)
+    if not np.issubdtype(a.dtype, np.integer):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(blocks, axis=(1, 3), dtype=np.float32).astype(a.dtype, copy=False)
+
+    # Packed counts: mean of the valid counts, rounded back to a count
+    valid = blocks != fill if fill is not None else np.ones(blocks.shape, dtype=bool)
+    n = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.float64)
+    out = np.full(n.shape, 0 if fill is None else fill, dtype=a.dtype)
+    out[n > 0] = np.rint(total[n > 0] / n[n > 0])
+    return out
+
+
+def block_average(ds, factor):
+
+    # factor x factor block means of every (y, x) variable and of the x/y
+    # coordinates, taken before any recipe runs. Datasets of packed counts
+    # (raw=True) stay packed counts, averaged over the valid pixels only.
+    import xarray as xr
+
+    if factor <= 1:
+        return ds
+
+    variables = {}
+    for name, var in ds.data_vars.items():
+        if var.dims != ('y', 'x'):
+            variables[name] = var
+            continue
+        data = np.asarray(var.values)
+        fill = var.attrs.get('_FillValue')
+        if data.dtype.kind == 'i' and str(var.attrs.get('_Unsigned', 'false')).lower() == 'true':
+            # Counts stored signed but meant unsigned (e.g. -1 is 65535)
+            unsigned = np.dtype(data.dtype.str.replace('i', 'u'))
+            fill = None if fill is None else np.asarray(fill, dtype=data.dtype).view(unsigned)
+            data = _block_mean(data.view(unsigned), factor, fill).view(data.dtype)
+        else:
+            data = _block_mean(data, factor, fill)
+        variables[name] = (('y', 'x'), data, var.attrs)
+
+    coords = {name: coord for name, coord in ds.coords.items() if not {'y', 'x'} & set(coord.dims)}
+    coords['y'] = ('y', block_mean_1d(ds.y, factor), ds.y.attrs)
+    coords['x'] = ('x', block_mean_1d(ds.x, factor), ds.x.attrs)
+    return xr.Dataset(variables, coords=coords, attrs=ds.attrs)